@@ -0,0 +1,314 @@
+import argparse
+import contextlib
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+# 性能测试：在本地启动模拟的一刻相册服务器，测量下载相关的改动效果
+# 用法: python benchmark.py engines --files 500 --size 200000 --latency 0.05
+#       python benchmark.py disk --dir /mnt/nas/tmp --files 256 --size 4194304 --threads 32
+#       python benchmark.py memory --files 300 --size 4194304
+
+
+def file_content(fsid, size):
+    """模拟服务器上的文件内容，按 fsid 生成，保证可复现"""
+    block = hashlib.sha256(str(fsid).encode()).digest()
+    return (block * (size // len(block) + 1))[:size]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """模拟 /youai/file/v2/download 接口和 dlink 文件下载"""
+    protocol_version = "HTTP/1.1"
+    size = 200000
+    latency = 0.0
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status, body, headers=()):
+        self.send_response(status)
+        for key, value in headers:
+            self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/youai/file/v2/download":
+            fsid = parse_qs(url.query)["fsid"][0]
+            dlink = f"http://{self.headers['Host']}/file/{fsid}"
+            return self.send_body(200, f'{{"dlink": "{dlink}"}}'.encode(), [("Content-Type", "application/json")])
+        if url.path.startswith("/file/"):
+            time.sleep(self.latency)  # 模拟首字节延迟
+            content = file_content(int(url.path[6:]), self.size)
+            range_header = self.headers.get("Range")
+            if range_header:
+                start, _, end = range_header[6:].partition("-")
+                start, end = int(start), int(end) if end else len(content) - 1
+                return self.send_body(206, content[start:end + 1],
+                                      [("Content-Range", f"bytes {start}-{end}/{len(content)}")])
+            return self.send_body(200, content)
+        self.send_body(404, b"")
+
+
+def serve(size, latency, port_queue):
+    handler = type("Handler", (MockHandler,), {"size": size, "latency": latency})
+    # listen 的队列长度在构造时生效，需要在子类上设置
+    server_cls = type("Server", (ThreadingHTTPServer,), {"daemon_threads": True, "request_queue_size": 1024})
+    server = server_cls(("127.0.0.1", 0), handler)
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def start_server(size, latency):
+    """在独立进程中启动模拟服务器（避免与下载器争抢GIL），返回 (进程, base_url)"""
+    port_queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=serve, args=(size, latency, port_queue), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{port_queue.get()}"
+
+
+def make_photos(count, size):
+    """生成模拟的列表接口记录"""
+    photos = []
+    for i in range(count):
+        fsid = 10000 + i
+        photos.append({
+            "fsid": fsid,
+            "path": f"/mnt/yike/fs/IMG_{fsid}.jpg",
+            "size": size,
+            "md5": hashlib.md5(file_content(fsid, size)).hexdigest(),
+            "extra_info": {"date_time": f"2024:01:{i % 28 + 1:02d} 12:00:00"},
+        })
+    return photos
+
+
+def run_engine(engine_cls, workdir, base_url, photos, config=None, setup=None):
+    """在独立目录中用指定引擎下载全部照片，返回 (耗时, 失败数)；
+    不经过 check_auth，需要调整的下载器属性由 setup(downloader) 设置"""
+    from photographCatalog import photographCatalog
+
+    workdir.mkdir(parents=True)
+    old_cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        catalog = photographCatalog()
+        catalog.upsert_photos(photos)
+        catalog.close()
+
+        downloader = engine_cls()
+        downloader.logger.setLevel(logging.WARNING)
+        downloader.URL = f"{base_url}/youai/file/v2/download"
+        downloader.clienttype = 70
+        downloader.bdstoken = "benchmark"
+        downloader.config = config or {}
+        if setup:
+            setup(downloader)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stderr(io.StringIO()):  # 屏蔽进度条
+            downloader.download_photos()
+        elapsed = time.perf_counter() - start
+        downloader.catalog.close()
+        return elapsed, len(downloader.failed_photos)
+    finally:
+        os.chdir(old_cwd)
+
+
+def report(name, count, size, elapsed, failed):
+    total_mb = count * size / 1024 / 1024
+    print(f"{name:<12} 文件 {count:>6}  耗时 {elapsed:>7.2f} 秒  "
+          f"{count / elapsed:>8.1f} 文件/秒  {total_mb / elapsed:>7.1f} MB/s  失败 {failed}")
+
+
+def bench_engines(args):
+    """对比线程池引擎和 asyncio 引擎"""
+    from photographDownload import photographDownload
+
+    engines = [("threads", photographDownload, {})]
+    try:
+        from photographAsyncDownload import aiohttp, photographAsyncDownload
+        if aiohttp is not None:
+            engines.append(("asyncio", photographAsyncDownload, {"async_concurrency": args.concurrency}))
+        else:
+            print("未安装 aiohttp，跳过 asyncio 引擎")
+    except ImportError:
+        print("未找到 asyncio 引擎，跳过")
+
+    server, base_url = start_server(args.size, args.latency)
+    photos = make_photos(args.files, args.size)
+    print(f"模拟服务器: {base_url}，{args.files} 个文件，每个 {args.size} 字节，首字节延迟 {args.latency * 1000:.0f} ms")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, engine_cls, config in engines:
+            elapsed, failed = run_engine(engine_cls, Path(tmp) / name, base_url, photos, config)
+            report(name, args.files, args.size, elapsed, failed)
+    server.terminate()
+
+
+def write_file(path, size, block, buffer_size, prealloc, directories, sync, rate=0):
+    """按下载器的写入方式写一个文件：写入 .part，按块写入后改名；rate 为模拟的单个下载速度(字节/秒)"""
+    from photographDisk import preallocate
+
+    if directories is None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+    else:
+        directories.ensure(path.parent)
+    part = path.with_name(path.name + ".part")
+    with open(part, "wb", buffering=buffer_size) as f:
+        if prealloc:
+            preallocate(f.fileno(), 0, size)
+        view = memoryview(block)
+        for offset in range(0, size, len(block)):
+            f.write(view[:min(len(block), size - offset)])
+            if rate:
+                time.sleep(len(block) / rate)
+    sync.before_rename(part)
+    os.replace(part, path)
+    sync.completed(path)
+
+
+def count_extents(paths):
+    """用 filefrag 统计文件的平均 extent 数（碎片程度），没有 filefrag 时返回 None"""
+    if not shutil.which("filefrag"):
+        return None
+    output = subprocess.run(["filefrag", *map(str, paths)], capture_output=True, text=True).stdout
+    counts = [int(n) for n in re.findall(r"(\d+) extents? found", output)]
+    return sum(counts) / len(counts) if counts else None
+
+
+def bench_disk(args):
+    """对比写文件的方式：预分配、写缓冲、目录缓存和 fsync 策略"""
+    from photographDisk import DirectoryCache, SyncPolicy
+
+    variants = [
+        ("基线", dict(prealloc=False, buffer_size=io.DEFAULT_BUFFER_SIZE, cache_dirs=False, fsync="off")),
+        ("预分配", dict(prealloc=True, buffer_size=io.DEFAULT_BUFFER_SIZE, cache_dirs=False, fsync="off")),
+        ("预分配+缓冲", dict(prealloc=True, buffer_size=args.buffer, cache_dirs=True, fsync="off")),
+        ("fsync=batch", dict(prealloc=True, buffer_size=args.buffer, cache_dirs=True, fsync="batch")),
+        ("fsync=file", dict(prealloc=True, buffer_size=args.buffer, cache_dirs=True, fsync="file")),
+    ]
+    block = os.urandom(args.chunk)
+    print(f"目录: {args.dir or tempfile.gettempdir()}，{args.files} 个文件，每个 {args.size} 字节，{args.threads} 个线程同时写入，"
+          f"每块 {args.chunk} 字节，写缓冲 {args.buffer} 字节")
+    for name, options in variants:
+        with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+            paths = [Path(tmp) / f"2024-01-{i % 28 + 1:02d}" / f"IMG_{i:05d}.jpg" for i in range(args.files)]
+            directories = DirectoryCache() if options["cache_dirs"] else None
+            sync = SyncPolicy()
+            sync.configure(options["fsync"])
+            if hasattr(os, "sync"):
+                os.sync()  # 上一组的脏页不计入本组
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.threads) as executor:
+                for future in [
+                    executor.submit(write_file, path, args.size, block, options["buffer_size"],
+                                    options["prealloc"], directories, sync, args.rate)
+                    for path in paths
+                ]:
+                    future.result()
+            sync.flush()
+            elapsed = time.perf_counter() - start
+            if hasattr(os, "sync"):
+                os.sync()  # 延迟分配的文件系统在写回时才分配空间，之后再统计碎片
+            extents = count_extents(paths)
+            total_mb = args.files * args.size / 1024 / 1024
+            print(f"{name:<12} 耗时 {elapsed:>7.2f} 秒  {total_mb / elapsed:>8.1f} MB/s  "
+                  f"平均 extent 数 {'-' if extents is None else f'{extents:.2f}'}")
+
+
+def measure_engine(workdir, base_url, photos, use_readinto, results):
+    """在子进程中运行线程池引擎，返回峰值内存、缺页次数和CPU时间（子进程的统计不受其他测试组影响）"""
+    import resource
+
+    from photographDownload import photographDownload
+
+    engine = []
+
+    def setup(downloader):
+        engine.append(downloader)
+        downloader.use_readinto = use_readinto
+        downloader.dedup.configure("off")
+        # 关闭自适应并发，全部线程从一开始就同时下载
+        downloader.configure_concurrency({"adaptive_concurrency": False})
+
+    elapsed, failed = run_engine(photographDownload, workdir, base_url, photos, setup=setup)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    # Linux 上 ru_maxrss 的单位是 KB，macOS 上是字节
+    peak = usage.ru_maxrss if sys.platform == "darwin" else usage.ru_maxrss * 1024
+    results.put((elapsed, failed, peak, usage.ru_minflt, usage.ru_utime + usage.ru_stime, engine[0].buffers.created))
+
+
+def bench_memory(args):
+    """在全部下载线程同时工作时，对比 readinto 复用缓冲区和 iter_content 的内存与CPU开销"""
+    try:
+        import resource  # noqa: F401
+    except ImportError:
+        print("当前系统没有 resource 模块（Windows），无法统计内存")
+        return
+
+    variants = [("iter_content", False), ("readinto", True)]
+    server, base_url = start_server(args.size, args.latency)
+    photos = make_photos(args.files, args.size)
+    context = multiprocessing.get_context("spawn")  # 每组在全新的进程中运行，峰值内存互不影响
+    total_mb = args.files * args.size / 1024 / 1024
+    print(f"模拟服务器: {base_url}，{args.files} 个文件，每个 {args.size} 字节，全部下载线程同时工作")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, use_readinto in variants:
+            results = context.Queue()
+            process = context.Process(target=measure_engine,
+                                      args=(Path(tmp) / name, base_url, photos, use_readinto, results))
+            process.start()
+            elapsed, failed, peak, faults, cpu, buffers = results.get()
+            process.join()
+            print(f"{name:<12} 耗时 {elapsed:>7.2f} 秒  {total_mb / elapsed:>7.1f} MB/s  峰值内存 {peak / 1024 / 1024:>7.1f} MB  "
+                  f"缺页 {faults:>8}  CPU {cpu:>6.2f} 秒  读缓冲区 {buffers:>3} 个  失败 {failed}")
+    server.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="下载器性能测试（本地模拟服务器）")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    engines = subparsers.add_parser("engines", help="对比线程池引擎和 asyncio 引擎")
+    engines.add_argument("--files", type=int, default=500, help="文件数")
+    engines.add_argument("--size", type=int, default=200000, help="每个文件的字节数")
+    engines.add_argument("--latency", type=float, default=0.05, help="模拟的首字节延迟(秒)")
+    engines.add_argument("--concurrency", type=int, default=200, help="asyncio 引擎的并发数")
+    engines.set_defaults(func=bench_engines)
+
+    disk = subparsers.add_parser("disk", help="对比预分配、写缓冲和 fsync 策略的写入速度和碎片")
+    disk.add_argument("--dir", default=None, help="写入测试文件的目录（默认系统临时目录），应放在下载目录所在的磁盘上")
+    disk.add_argument("--files", type=int, default=256, help="文件数")
+    disk.add_argument("--size", type=int, default=4 * 1024 * 1024, help="每个文件的字节数")
+    disk.add_argument("--threads", type=int, default=32, help="同时写入的线程数")
+    disk.add_argument("--chunk", type=int, default=512 * 1024, help="每次写入的字节数（与下载块大小一致）")
+    disk.add_argument("--buffer", type=int, default=1024 * 1024, help="写缓冲大小")
+    disk.add_argument("--rate", type=int, default=0,
+                      help="模拟每个下载的速度(字节/秒)，0表示不限；慢速并发写入时碎片更明显")
+    disk.set_defaults(func=bench_disk)
+
+    memory = subparsers.add_parser("memory", help="对比 readinto 复用缓冲区和 iter_content 的内存和CPU开销")
+    memory.add_argument("--files", type=int, default=300, help="文件数")
+    memory.add_argument("--size", type=int, default=4 * 1024 * 1024, help="每个文件的字节数")
+    memory.add_argument("--latency", type=float, default=0.0, help="模拟的首字节延迟(秒)")
+    memory.set_defaults(func=bench_memory)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
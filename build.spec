@@ -13,6 +13,18 @@ a = Analysis(
         'PySide6.QtWidgets',
         'photographListDownload',
         'photographDownload',
+        'photographCatalog',
+        'photographPipeline',
+        'photographSession',
+        'photographConcurrency',
+        'photographBandwidth',
+        'photographLinks',
+        'photographProgress',
+        'photographLogging',
+        'photographScheduler',
+        'photographDedup',
+        'photographDisk',
+        'sqlite3',
         'requests',
         'tqdm',
         'urllib3',
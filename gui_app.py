@@ -28,6 +28,8 @@ from PySide6.QtWidgets import (
 
 from photographDownload import photographDownload
 from photographListDownload import photographListDownload
+from photographPipeline import photographPipeline
+from photographScheduler import SCHEDULE_POLICIES
 
 
 class DownloadThread(QThread):
@@ -35,17 +37,20 @@ class DownloadThread(QThread):
 
     log_signal = Signal(str)
     progress_signal = Signal(int, int)
+    concurrency_signal = Signal(str, int)
     finished_signal = Signal(bool, str)
 
     def __init__(self, mode, settings):
         super().__init__()
-        self.mode = mode  # 'metadata' 或 'download'
+        self.mode = mode  # 'metadata'、'download' 或 'pipeline'
         self.settings = settings
 
     def run(self):
         try:
             if self.mode == "metadata":
                 self.download_metadata()
+            elif self.mode == "pipeline":
+                self.download_pipeline()
             else:
                 self.download_photos()
             self.finished_signal.emit(True, "完成！")
@@ -74,7 +79,8 @@ class DownloadThread(QThread):
         builtins.print = custom_print
 
         try:
-            downloader.start()
+            if not downloader.start():
+                raise RuntimeError("元数据获取未完成，详见日志")
         finally:
             builtins.print = original_print
 
@@ -87,8 +93,44 @@ class DownloadThread(QThread):
             json.dump(self.settings, f, ensure_ascii=False, indent=4)
 
         downloader = photographDownload()
+        downloader.on_concurrency_change = self.concurrency_signal.emit
+        downloader.progress.on_update = self.progress_signal.emit
+        self.redirect_logger(downloader.logger)
 
-        # 重定向日志
+        downloader.start()
+
+    def download_pipeline(self):
+        """边获取元数据边下载"""
+        self.log_signal.emit("开始边获取元数据边下载...")
+
+        # 保存配置
+        with open("settings.json", "w", encoding="utf-8") as f:
+            json.dump(self.settings, f, ensure_ascii=False, indent=4)
+
+        pipeline = photographPipeline()
+        pipeline.downloader.on_concurrency_change = self.concurrency_signal.emit
+        pipeline.downloader.progress.on_update = self.progress_signal.emit
+        self.redirect_logger(pipeline.logger)
+
+        # 重定向元数据线程的输出
+        original_print = print
+
+        def custom_print(*args, **kwargs):
+            message = " ".join(map(str, args))
+            self.log_signal.emit(message)
+
+        import builtins
+
+        builtins.print = custom_print
+
+        try:
+            if not pipeline.start():
+                raise RuntimeError("元数据获取未完成，只下载了已获取到的照片，详见日志")
+        finally:
+            builtins.print = original_print
+
+    def redirect_logger(self, logger):
+        """把下载器的日志重定向到界面"""
         import logging
 
         class QtLogHandler(logging.Handler):
@@ -101,16 +143,14 @@ class DownloadThread(QThread):
                 self.signal.emit(msg)
 
         # 清除现有handlers
-        downloader.logger.handlers.clear()
+        logger.handlers.clear()
 
         # 添加Qt handler
         qt_handler = QtLogHandler(self.log_signal)
         qt_handler.setFormatter(
             logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
         )
-        downloader.logger.addHandler(qt_handler)
-
-        downloader.start()
+        logger.addHandler(qt_handler)
 
 
 class MainWindow(QMainWindow):
@@ -124,6 +164,8 @@ class MainWindow(QMainWindow):
             self.setWindowIcon(QIcon("icon.ico"))
 
         self.download_thread = None
+        self.loaded_settings = {}
+        self.concurrency_limits = {}  # 当前的并发上限，如 {"下载链接": 8, "文件传输": 16}
         self.setup_styles()
         self.init_ui()
         self.load_settings()
@@ -387,6 +429,30 @@ class MainWindow(QMainWindow):
         filter_hidden_layout.addStretch()
         advanced_layout.addLayout(filter_hidden_layout)
 
+        # 增量同步
+        incremental_layout = QHBoxLayout()
+        self.incremental_check = QCheckBox("增量同步（遇到已获取过的照片后停止翻页）")
+        incremental_layout.addWidget(self.incremental_check)
+        incremental_layout.addStretch()
+        advanced_layout.addLayout(incremental_layout)
+
+        # 下载顺序
+        policy_layout = QHBoxLayout()
+        policy_label = QLabel("下载顺序:")
+        policy_label.setFont(QFont("Microsoft YaHei UI", 10))
+        policy_layout.addWidget(policy_label)
+        self.policy_combo = QComboBox()
+        # 与 SCHEDULE_POLICIES 的顺序一致
+        self.policy_combo.addItems([
+            "newest (新照片优先)",
+            "smallest (小文件优先，尽早完成更多文件)",
+            "largest (大文件优先，避免最后只剩大文件)",
+            "interleave (大小文件交错，保持带宽占满)",
+        ])
+        policy_layout.addWidget(self.policy_combo)
+        policy_layout.addStretch()
+        advanced_layout.addLayout(policy_layout)
+
         advanced_group.setLayout(advanced_layout)
         layout.addWidget(advanced_group)
 
@@ -464,6 +530,11 @@ class MainWindow(QMainWindow):
         self.download_btn.clicked.connect(self.download_photos)
         btn_layout.addWidget(self.download_btn)
 
+        self.pipeline_btn = QPushButton("⚡ 边获取边下载")
+        self.pipeline_btn.setMinimumHeight(40)
+        self.pipeline_btn.clicked.connect(self.download_pipeline)
+        btn_layout.addWidget(self.pipeline_btn)
+
         self.stop_btn = QPushButton("⏹️ 停止")
         self.stop_btn.setMinimumHeight(40)
         self.stop_btn.setObjectName("danger_btn")
@@ -515,6 +586,10 @@ class MainWindow(QMainWindow):
         )
         progress_layout.addWidget(self.progress_bar)
 
+        self.concurrency_label = QLabel("")
+        self.concurrency_label.setStyleSheet("color: #666666; font-size: 12px;")
+        progress_layout.addWidget(self.concurrency_label)
+
         layout.addWidget(progress_widget)
 
         # 日志输出区域
@@ -690,13 +765,17 @@ class MainWindow(QMainWindow):
 
     def get_settings(self):
         """获取当前配置"""
-        settings = {
+        # 保留界面上没有的配置项（如手动写入 settings.json 的高级参数）
+        settings = dict(self.loaded_settings)
+        settings.update({
             "clienttype": self.clienttype_input.value(),
             "bdstoken": self.bdstoken_input.text(),
             "need_thumbnail": 1 if self.thumbnail_check.isChecked() else 0,
             "need_filter_hidden": 1 if self.filter_hidden_check.isChecked() else 0,
+            "incremental": self.incremental_check.isChecked(),
+            "schedule_policy": SCHEDULE_POLICIES[self.policy_combo.currentIndex()],
             "Cookie": self.cookie_input.toPlainText().strip(),
-        }
+        })
 
         # 日期过滤
         if self.date_filter_check.isChecked():
@@ -738,6 +817,7 @@ class MainWindow(QMainWindow):
                 with open("settings.json", "r", encoding="utf-8") as f:
                     settings = json.load(f)
 
+                self.loaded_settings = settings
                 self.clienttype_input.setValue(settings.get("clienttype", 70))
                 self.bdstoken_input.setText(settings.get("bdstoken", ""))
                 self.cookie_input.setPlainText(settings.get("Cookie", ""))
@@ -745,6 +825,11 @@ class MainWindow(QMainWindow):
                 self.filter_hidden_check.setChecked(
                     settings.get("need_filter_hidden", 0) == 1
                 )
+                self.incremental_check.setChecked(settings.get("incremental", False))
+                policy = settings.get("schedule_policy", "newest")
+                self.policy_combo.setCurrentIndex(
+                    SCHEDULE_POLICIES.index(policy) if policy in SCHEDULE_POLICIES else 0
+                )
 
                 if settings.get("filter_date"):
                     self.date_filter_check.setChecked(True)
@@ -779,6 +864,7 @@ class MainWindow(QMainWindow):
         self.log_text.clear()
         self.metadata_btn.setEnabled(False)
         self.download_btn.setEnabled(False)
+        self.pipeline_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         self.progress_bar.setValue(0)
         self.progress_label.setText("📊 正在获取元数据...")
@@ -796,7 +882,9 @@ class MainWindow(QMainWindow):
             self.update_status("任务运行中", "warning")
             return
 
-        if not Path("./json/").exists() or not list(Path("./json/").glob("*.json")):
+        has_catalog = Path("./photos.db").exists()
+        has_legacy_json = Path("./json/").exists() and any(Path("./json/").glob("*.json"))
+        if not has_catalog and not has_legacy_json:
             self.append_log("✗ 请先获取照片元数据")
             self.update_status("缺少元数据", "error")
             QMessageBox.warning(
@@ -809,6 +897,7 @@ class MainWindow(QMainWindow):
         self.log_text.clear()
         self.metadata_btn.setEnabled(False)
         self.download_btn.setEnabled(False)
+        self.pipeline_btn.setEnabled(False)
         self.stop_btn.setEnabled(True)
         self.progress_bar.setValue(0)
         self.progress_label.setText("📊 正在下载照片...")
@@ -816,9 +905,57 @@ class MainWindow(QMainWindow):
 
         self.download_thread = DownloadThread("download", settings)
         self.download_thread.log_signal.connect(self.append_log)
+        self.download_thread.concurrency_signal.connect(self.update_concurrency)
+        self.download_thread.progress_signal.connect(self.update_progress)
+        self.download_thread.finished_signal.connect(self.on_download_finished)
+        self.download_thread.start()
+
+    def download_pipeline(self):
+        """边获取元数据边下载"""
+        if self.download_thread and self.download_thread.isRunning():
+            self.append_log("⚠ 已有任务在运行中...")
+            self.update_status("任务运行中", "warning")
+            return
+
+        settings = self.get_settings()
+        if not settings["bdstoken"] or not settings["Cookie"]:
+            self.append_log("✗ 请先配置 BDSToken 和 Cookie")
+            self.update_status("配置不完整", "error")
+            QMessageBox.warning(
+                self, "配置错误", "请先在「配置」页面填写 BDSToken 和 Cookie"
+            )
+            return
+
+        self.log_text.clear()
+        self.metadata_btn.setEnabled(False)
+        self.download_btn.setEnabled(False)
+        self.pipeline_btn.setEnabled(False)
+        self.stop_btn.setEnabled(True)
+        self.progress_bar.setValue(0)
+        self.progress_label.setText("📊 正在边获取元数据边下载...")
+        self.update_status("获取并下载中...", "info")
+
+        self.download_thread = DownloadThread("pipeline", settings)
+        self.download_thread.log_signal.connect(self.append_log)
+        self.download_thread.concurrency_signal.connect(self.update_concurrency)
+        self.download_thread.progress_signal.connect(self.update_progress)
         self.download_thread.finished_signal.connect(self.on_download_finished)
         self.download_thread.start()
 
+    def update_progress(self, done, total):
+        """显示下载器汇总的进度，总数未知时只显示已处理数"""
+        if total:
+            self.progress_bar.setValue(int(done * 100 / total))
+            self.progress_label.setText(f"📊 已处理 {done} / {total}")
+        else:
+            self.progress_label.setText(f"📊 已处理 {done}")
+
+    def update_concurrency(self, name, limit):
+        """显示下载器当前的并发上限"""
+        self.concurrency_limits[name] = limit
+        text = "  ".join(f"{key}: {value}" for key, value in self.concurrency_limits.items())
+        self.concurrency_label.setText(f"⚙ 并发上限  {text}")
+
     def stop_download(self):
         """停止下载"""
         if self.download_thread and self.download_thread.isRunning():
@@ -839,6 +976,7 @@ class MainWindow(QMainWindow):
         """下载完成"""
         self.metadata_btn.setEnabled(True)
         self.download_btn.setEnabled(True)
+        self.pipeline_btn.setEnabled(True)
         self.stop_btn.setEnabled(False)
         self.progress_bar.setValue(100 if success else 0)
         self.progress_label.setText("✓ 任务完成" if success else "✗ 任务失败")
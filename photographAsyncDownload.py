@@ -0,0 +1,331 @@
+import asyncio
+import hashlib
+import threading
+import time
+from pathlib import Path
+
+from photographConcurrency import THROTTLE_STATUS, is_throttle_error
+from photographDisk import preallocate
+from photographDownload import photographDownload
+from photographLinks import DlinkExpiredError, is_link_expired
+from photographScheduler import ABORT, GIVE_UP, PermanentError, classify_error, retry_delay
+
+try:
+    import aiohttp
+except ImportError:  # aiohttp 是可选依赖，只有 asyncio 引擎需要
+    aiohttp = None
+
+
+# asyncio 下载引擎：单线程事件循环中同时保持数百个下载，
+# 下载历史、失败记录、断点续传和校验逻辑与线程池引擎共用
+class photographAsyncDownload(photographDownload):
+    def __init__(self):
+        if aiohttp is None:
+            raise RuntimeError("asyncio 下载引擎需要安装 aiohttp: pip install aiohttp")
+        super().__init__()
+        self.concurrency = 200  # 同时处理的照片数
+        # 事件循环中的请求开销小，并发上限的默认范围比线程池引擎大
+        self.link_limiter.maximum = 100
+        self.transfer_limiter.maximum = 200
+
+    async def download_with_resume_async(self, session, url, filepath, file_size=None, file_id=None):
+        """支持断点续传的异步下载，filepath 为 .part 文件，边下载边计算MD5，成功时返回哈希值，失败时抛出异常。
+        续传只接受范围正确的206响应；服务器返回200时说明不支持续传或文件已变化，从头写入"""
+        hash_md5 = hashlib.md5()
+        current_size = filepath.stat().st_size if filepath.exists() else 0
+        if file_size and current_size >= file_size:
+            # 没有记录能证明完整大小的 .part 是本程序完整写入的（可能是校验失败或被 --deep-verify 剔除的文件），从头下载
+            filepath.unlink()
+            if file_id:
+                await asyncio.to_thread(self.catalog.delete_partial, file_id)
+            current_size = 0
+        if current_size:
+            # 续传时只读一遍已有的部分，之后对新数据增量计算；大文件可能要读几百MB，在线程中进行
+            await asyncio.to_thread(self.update_hash_from_file, hash_md5, filepath)
+            headers = await asyncio.to_thread(self.range_headers, file_id, current_size)
+        else:
+            headers = self.headers.copy()
+        resumed_from = current_size
+
+        await self.transfer_limiter.acquire_async()
+        try:
+            start = time.perf_counter()
+            async with session.get(url, headers=headers) as response:
+                ttfb = time.perf_counter() - start
+                if response.status == 416:
+                    # 已下载的部分超出了服务器上的文件，下次从头下载
+                    filepath.unlink(missing_ok=True)
+                    if "If-Range" in headers:
+                        await asyncio.to_thread(self.catalog.delete_partial, file_id)
+                response.raise_for_status()
+                validator = self.response_validator(response.headers)
+                if current_size and response.status == 206:
+                    self.check_content_range(response.headers.get("Content-Range"), current_size, file_size)
+                    mode = 'ab'
+                else:
+                    if current_size:
+                        self.logger.info(f"{filepath.name} 无法续传（状态码 {response.status}），从头下载")
+                        if "If-Range" in headers:
+                            await asyncio.to_thread(self.catalog.delete_partial, file_id)
+                            headers.pop("If-Range")
+                        hash_md5 = hashlib.md5()
+                        current_size = resumed_from = 0
+                    mode = 'wb'
+                total_size = (response.content_length or 0) + current_size
+
+                if total_size > self.max_file_size:
+                    raise PermanentError(f"文件大小超过限制: {total_size} > {self.max_file_size}")
+                if file_size and response.content_length is not None and total_size != file_size:
+                    raise ValueError(f"服务器返回的大小与元数据不一致: {total_size} != {file_size}")
+                # 收到响应头就记下文件版本，进程中途被结束时下次续传也能用 If-Range 确认服务器上的文件没有变化
+                if file_id and validator and headers.get("If-Range") != validator:
+                    await asyncio.to_thread(self.catalog.save_partial, file_id, validator)
+
+                with open(filepath, mode, buffering=self.write_buffer) as f:
+                    if self.preallocate:
+                        preallocate(f.fileno(), current_size, total_size - current_size)
+                    async for chunk in response.content.iter_chunked(self.chunk_size):
+                        await self.bandwidth.consume_async(len(chunk))
+                        f.write(chunk)
+                        self.progress.add_bytes(len(chunk))
+                        hash_md5.update(chunk)
+                        current_size += len(chunk)
+                        if file_size and current_size > file_size:
+                            raise ValueError(f"下载的数据超过元数据中的大小: {file_size}")
+            self.transfer_limiter.record(current_size - resumed_from, ttfb)
+            if file_id and (validator or "If-Range" in headers):
+                await asyncio.to_thread(self.catalog.delete_partial, file_id)
+            return hash_md5.hexdigest()
+        except Exception as e:
+            if is_link_expired(e):
+                raise DlinkExpiredError(str(e)) from e
+            if is_throttle_error(e):
+                self.transfer_limiter.record(throttled=True)
+            raise
+        finally:
+            self.transfer_limiter.release()
+
+    async def resolve_dlink_async(self, session, fsid):
+        """异步获取下载链接，受下载链接并发上限控制"""
+        params = {
+            "clienttype": self.clienttype,
+            "bdstoken": self.bdstoken,
+            "fsid": fsid
+        }
+        await self.link_limiter.acquire_async()
+        try:
+            start = time.perf_counter()
+            async with session.get(self.URL, params=params) as response:
+                ttfb = time.perf_counter() - start
+                if response.status in THROTTLE_STATUS:
+                    self.link_limiter.record(throttled=True)
+                response.raise_for_status()
+                r_json = await response.json(content_type=None)
+            self.link_limiter.record(ttfb=ttfb)
+        finally:
+            self.link_limiter.release()
+        return self.parse_dlink(r_json)
+
+    async def get_dlink_async(self, session, fsid):
+        """优先使用缓存中仍然有效的下载链接，没有时异步获取并缓存"""
+        dlink = self.links.cached(fsid)
+        if dlink:
+            self.links.hits += 1
+            return dlink
+        resolved_at = time.time()
+        dlink = await self.resolve_dlink_async(session, fsid)
+        self.links.resolved += 1
+        return await asyncio.to_thread(self.links.store, fsid, dlink, resolved_at)
+
+    async def download_verified_async(self, session, url, filepath, expected_size=None, expected_md5=None,
+                                      file_id=None):
+        """下载到 .part 文件并校验，通过后原子地改名为 filepath；
+        与服务器的大小或MD5不一致时删除文件立即重新下载一次"""
+        part = self.prepare_part(filepath, expected_size)
+        for attempt in range(2):
+            if self.use_segments(expected_size, file_id):
+                # 大文件的分段下载在线程中进行，不阻塞事件循环
+                file_hash = await asyncio.to_thread(self.download_segmented, url, part, expected_size, file_id)
+            else:
+                file_hash = await self.download_with_resume_async(session, url, part, expected_size, file_id)
+            mismatch = self.verify_checksum(part, file_hash, expected_size, expected_md5)
+            if not mismatch:
+                # fsync=file 时要等待磁盘写入，不阻塞事件循环
+                await asyncio.to_thread(self.commit_part, part, filepath)
+                return file_hash
+            self.logger.warning(f"{filepath.name} 校验失败（{mismatch}），删除后重新下载")
+            part.unlink(missing_ok=True)
+        raise ValueError(f"重新下载后校验仍然失败: {mismatch}")
+
+    async def attempt_download_async(self, session, date, filename, fsid):
+        """异步下载单张照片，成功返回None；失败时记录失败并返回异常"""
+        try:
+            # 安全过滤文件名
+            safe_filename = Path(filename).name
+            save_path = self.save_path / date / safe_filename
+            file_id = f"{date}_{safe_filename}_{fsid}"
+
+            # 检查是否已下载并验证完整性；文件状态变化时需要重新计算哈希，在线程中进行
+            if await asyncio.to_thread(self.validate_downloaded_file, file_id, save_path):
+                self.logger.debug(f"文件已下载且验证通过: {safe_filename}")
+                return None
+
+            # 创建保存目录
+            self.directories.ensure(save_path.parent)
+
+            # 同样内容已经下载过时直接链接，不再传输
+            expected_size, expected_md5 = await asyncio.to_thread(self.catalog.get_checksum, fsid)
+            if await asyncio.to_thread(self.link_duplicate, file_id, date, safe_filename, fsid, save_path,
+                                       expected_size, expected_md5):
+                return None
+
+            # 获取下载链接
+            dlink = await self.get_dlink_async(session, fsid)
+
+            # 下载文件，并与服务器提供的大小和MD5比对
+            try:
+                file_hash = await self.download_verified_async(
+                    session, dlink, save_path, expected_size, expected_md5, file_id
+                )
+            except DlinkExpiredError:
+                # 链接过期或被拒绝，重新获取一次
+                self.logger.info(f"下载链接已失效，重新获取: {safe_filename}")
+                await asyncio.to_thread(self.links.invalidate, fsid)
+                file_hash = await self.download_verified_async(
+                    session, await self.get_dlink_async(session, fsid),
+                    save_path, expected_size, expected_md5, file_id
+                )
+            # 合并重复文件可能需要复制整个文件，在线程中进行
+            await asyncio.to_thread(self.finish_download, file_id, date, safe_filename, fsid, save_path, file_hash)
+            return None
+        except Exception as e:
+            self.logger.error(f"处理文件 {filename} 失败: {str(e)}")
+
+            # 记录失败次数、错误类型和下次可重试时间
+            await asyncio.to_thread(self.record_failure, file_id, date, filename, fsid, e)
+
+            return e
+
+    async def download_all_async(self, pending_files, desc):
+        """固定数量的协程从队列中取照片下载，pending_files 在线程中边扫描边放入队列，返回最终失败的文件。
+        失败的照片按自己的退避时间重新排队，等待期间不占用协程，其他照片照常下载；
+        以前失败过的照片接着失败记录中的次数和重试时间继续"""
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        # 队列中尚未尝试过的照片数上限，扫描领先下载太多时暂停放入
+        slots = threading.Semaphore(self.concurrency * 2)
+        stop = threading.Event()
+        state = {"outstanding": 0, "feeding": True}  # 只在事件循环中修改
+        failed_files = []
+
+        def finish_if_done():
+            if not state["feeding"] and state["outstanding"] == 0:
+                for _ in range(self.concurrency):
+                    queue.put_nowait(None)
+
+        def schedule(item, attempts, delay, counted=False):
+            if delay > 0:
+                loop.call_later(delay, queue.put_nowait, (item, attempts, False))
+                if counted:
+                    slots.release()
+            else:
+                queue.put_nowait((item, attempts, counted))
+
+        def add(item):
+            state["outstanding"] += 1
+            attempts, delay = self.retry_state(item)
+            schedule(item, attempts, delay, counted=True)
+
+        def feeding_done(count):
+            # 扫描结束后总数才确定
+            self.progress.total = count
+            state["feeding"] = False
+            finish_if_done()
+
+        def feed():
+            count = 0
+            try:
+                for item in pending_files:
+                    while not slots.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    loop.call_soon_threadsafe(add, item)
+                    count += 1
+            finally:
+                loop.call_soon_threadsafe(feeding_done, count)
+
+        def finished(item, success):
+            if not success:
+                failed_files.append(item)
+            self.progress.file_done(success)
+            state["outstanding"] -= 1
+            finish_if_done()
+
+        async def worker(session):
+            while True:
+                entry = await queue.get()
+                if entry is None:
+                    return
+                item, attempts, counted = entry
+                if counted:
+                    slots.release()
+                error = await self.attempt_download_async(session, *item)
+                if error is None:
+                    finished(item, True)
+                    continue
+                attempts += 1
+                action = classify_error(error)
+                if action == ABORT:
+                    self.logger.error(f"认证失败，停止全部下载: {error}")
+                    raise error
+                if action == GIVE_UP:
+                    self.logger.warning(f"{item[1]} 无法下载，不再重试: {error}")
+                    finished(item, False)
+                    continue
+                if attempts >= self.max_attempts:
+                    finished(item, False)
+                    continue
+                # 失败记录已按同样的退避算好等待时间时直接沿用
+                recorded, delay = self.retry_state(item)
+                if recorded != attempts:
+                    delay = retry_delay(attempts, self.retry_base_delay, self.retry_max_delay)
+                schedule(item, attempts, delay)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(
+            sock_connect=float(self.config.get("http_connect_timeout", 10)),
+            sock_read=float(self.config.get("http_read_timeout", 60)),
+        )
+        self.progress.begin(None, desc)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=self.headers) as session:
+            feeder = asyncio.ensure_future(asyncio.to_thread(feed))
+            workers = [asyncio.ensure_future(worker(session)) for _ in range(self.concurrency)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # 认证失败时停止扫描并取消其余下载
+                stop.set()
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                await feeder
+                self.progress.end()
+        return failed_files
+
+    def download_pending(self, pending_files, handle=None, desc="下载进度", prefetch=True):
+        """在事件循环中下载待下载文件，每个文件失败后按自己的退避时间重试"""
+        if handle is not None:
+            # 自定义的处理函数是同步的，交给线程池引擎的调度器
+            return super().download_pending(pending_files, handle, desc, prefetch)
+        self.concurrency = int(self.config.get("async_concurrency", self.concurrency))
+        self.logger.info(f"开始下载（asyncio，并发 {self.concurrency}）")
+        self.load_content_index()
+        failed_files = asyncio.run(self.download_all_async(pending_files, desc))
+
+        if failed_files:
+            self.logger.warning(f"以下文件在最大尝试次数 ({self.max_attempts}) 后仍然下载失败或无法下载：")
+            for _, filename, _ in failed_files:
+                self.logger.warning(f"- {filename}")
+                self.failed_photos.add(filename)
@@ -0,0 +1,96 @@
+import asyncio
+import time
+from datetime import datetime
+from threading import Lock
+
+
+def parse_clock(value):
+    """把 "HH:MM" 转换为当天的分钟数"""
+    hour, _, minute = str(value).partition(":")
+    minutes = int(hour) * 60 + int(minute or 0)
+    if not 0 <= minutes <= 24 * 60:
+        raise ValueError(f"时间格式错误: {value}")
+    return minutes
+
+
+# 全局带宽限制：所有下载线程共用一个令牌桶，读取数据块后按字节数扣除令牌，
+# 令牌不足时先欠账再睡眠，停止读取 socket 让 TCP 自己降低发送速度
+class BandwidthLimiter:
+    def __init__(self, on_change=None):
+        self.on_change = on_change  # 生效的带宽上限变化时的回调，参数为 rate (字节/秒，0表示不限速)
+        self.default_rate = 0  # 不在任何时间段内时的带宽上限(字节/秒)，0表示不限速
+        self.schedule = []  # [(开始分钟, 结束分钟, 字节/秒), ...]
+        self.lock = Lock()
+        self.rate = 0  # 当前生效的带宽上限
+        self.tokens = 0.0
+        self.updated = time.monotonic()
+        self.next_check = 0.0  # 下次检查时间段的时间，避免每个数据块都读取本地时间
+
+    def configure(self, rate=0, schedule=None):
+        """设置带宽上限和时间段，时间段格式 [{"start": "09:00", "end": "18:00", "limit": 字节/秒}, ...]，
+        结束时间早于开始时间表示跨过午夜"""
+        windows = []
+        for window in schedule or []:
+            windows.append((parse_clock(window["start"]), parse_clock(window["end"]), int(window.get("limit") or 0)))
+        with self.lock:
+            self.default_rate = int(rate or 0)
+            self.schedule = windows
+            self.next_check = 0.0
+        self.current_rate()
+
+    def scheduled_rate(self, now=None):
+        """按本地时间计算应当生效的带宽上限"""
+        now = now or datetime.now()
+        minutes = now.hour * 60 + now.minute
+        for start, end, rate in self.schedule:
+            if start <= end:
+                if start <= minutes < end:
+                    return rate
+            elif minutes >= start or minutes < end:
+                return rate
+        return self.default_rate
+
+    def current_rate(self):
+        """当前生效的带宽上限，每秒最多重新计算一次时间段"""
+        now = time.monotonic()
+        if now < self.next_check:
+            return self.rate
+        rate = self.scheduled_rate()
+        changed = False
+        with self.lock:
+            self.next_check = now + 1.0
+            if rate != self.rate:
+                self.rate = rate
+                # 桶的容量为1秒的流量，切换上限时从满桶开始
+                self.tokens = float(rate)
+                self.updated = now
+                changed = True
+        if changed and self.on_change:
+            self.on_change(rate)
+        return rate
+
+    def reserve(self, size):
+        """扣除 size 字节的令牌，返回需要等待的秒数"""
+        rate = self.current_rate()
+        if not rate:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(float(rate), self.tokens + (now - self.updated) * rate)
+            self.updated = now
+            self.tokens -= size
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / rate
+
+    def consume(self, size):
+        """读取 size 字节后调用，超出带宽时阻塞当前线程"""
+        delay = self.reserve(size)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def consume_async(self, size):
+        """asyncio 引擎使用，超出带宽时让出事件循环"""
+        delay = self.reserve(size)
+        if delay > 0:
+            await asyncio.sleep(delay)
@@ -0,0 +1,437 @@
+import json
+import sqlite3
+import sys
+import time
+from pathlib import Path
+from threading import Lock
+
+# 遍历照片的顺序，大小缺失的照片排在最后
+ITEM_ORDERS = {
+    "newest": "date DESC, date_time DESC, fsid",
+    "smallest": "size IS NULL, size, date DESC, fsid",
+    "largest": "size DESC, date DESC, fsid",
+}
+
+# 照片元数据目录（SQLite），以 fsid 为主键，替代 ./json/ 下的逐文件存储
+class photographCatalog:
+    def __init__(self, db_path="./photos.db"):
+        self.db_path = Path(db_path)
+        self.lock = Lock()  # 同一连接在多个线程间共享，写操作需加锁
+        self.conn = sqlite3.connect(str(self.db_path), check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.create_tables()
+
+    def create_tables(self):
+        """创建数据表和索引"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS photos (
+                    fsid INTEGER PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    filename TEXT NOT NULL,
+                    date TEXT,
+                    date_time TEXT,
+                    size INTEGER,
+                    md5 TEXT,
+                    data TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_photos_date ON photos(date)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_photos_path ON photos(path)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_photos_md5 ON photos(md5, size)")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS history (
+                    file_id TEXT PRIMARY KEY,
+                    fsid INTEGER,
+                    date TEXT,
+                    filename TEXT,
+                    hash TEXT,
+                    size INTEGER,
+                    timestamp REAL,
+                    mtime_ns INTEGER,
+                    inode INTEGER
+                )
+                """
+            )
+            self.add_missing_columns("history", {"mtime_ns": "INTEGER", "inode": "INTEGER"})
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_fsid ON history(fsid)")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS failed (
+                    file_id TEXT PRIMARY KEY,
+                    fsid INTEGER,
+                    date TEXT,
+                    filename TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error_class TEXT,
+                    error TEXT,
+                    next_retry_at REAL,
+                    updated_at REAL
+                )
+                """
+            )
+            # 失败记录在每次下载开始时整表读入，按 file_id 查找，不需要按重试时间的索引
+            self.conn.execute("DROP INDEX IF EXISTS idx_failed_next_retry")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS segments (
+                    file_id TEXT NOT NULL,
+                    idx INTEGER NOT NULL,
+                    start INTEGER NOT NULL,
+                    end INTEGER NOT NULL,
+                    done INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (file_id, idx)
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS partials (
+                    file_id TEXT PRIMARY KEY,
+                    validator TEXT NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS dlinks (
+                    fsid INTEGER PRIMARY KEY,
+                    dlink TEXT NOT NULL,
+                    resolved_at REAL NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+                """
+            )
+
+    def add_missing_columns(self, table, columns):
+        """为旧版数据库补充新增的列"""
+        existing = {row["name"] for row in self.conn.execute(f"PRAGMA table_info({table})")}
+        for name, column_type in columns.items():
+            if name not in existing:
+                self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    @staticmethod
+    def photo_to_row(photo):
+        """把列表接口返回的单条记录转换为数据表行"""
+        # path前12个字符是"/mnt/yike/fs"前缀
+        filename = photo["path"][12:]
+        date_time = photo.get("extra_info", {}).get("date_time")
+        date = date_time[:10].replace(':', '-') if date_time else None
+        return (
+            int(photo["fsid"]),
+            photo["path"],
+            filename,
+            date,
+            date_time,
+            photo.get("size"),
+            photo.get("md5"),
+            json.dumps(photo, ensure_ascii=False, separators=(',', ':')),
+        )
+
+    @staticmethod
+    def row_to_item(row):
+        """从 photo_to_row 的结果中取出下载信息 (date, filename, fsid)，与 iter_items 一致"""
+        return row[3], row[2], row[0]
+
+    def upsert_photos(self, photo_list):
+        """批量写入照片记录，已存在的 fsid 会被更新"""
+        return self.upsert_rows([self.photo_to_row(photo) for photo in photo_list])
+
+    def upsert_rows(self, rows):
+        """批量写入 photo_to_row 转换后的行"""
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT INTO photos (fsid, path, filename, date, date_time, size, md5, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(fsid) DO UPDATE SET
+                    path = excluded.path,
+                    filename = excluded.filename,
+                    date = excluded.date,
+                    date_time = excluded.date_time,
+                    size = excluded.size,
+                    md5 = excluded.md5,
+                    data = excluded.data
+                """,
+                rows,
+            )
+        return len(rows)
+
+    def count(self):
+        """照片总数"""
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM photos").fetchone()[0]
+
+    def iter_items(self, order="newest", with_size=False):
+        """按 order 遍历所有照片的下载信息 (date, filename, fsid)，不解析完整 JSON；
+        with_size=True 时产出 ((date, filename, fsid), 服务器记录的大小)"""
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT fsid, filename, date, size FROM photos ORDER BY {ITEM_ORDERS[order]}"
+            ).fetchall()
+        for row in rows:
+            item = (row["date"], row["filename"], row["fsid"])
+            yield (item, row["size"]) if with_size else item
+
+    def get_checksum(self, fsid):
+        """服务器提供的文件大小和MD5 (size, md5)，没有记录时为 (None, None)"""
+        with self.lock:
+            row = self.conn.execute("SELECT size, md5 FROM photos WHERE fsid = ?", (int(fsid),)).fetchone()
+        return (row["size"], row["md5"]) if row else (None, None)
+
+    def find_duplicates(self, fsid, md5, size):
+        """服务器MD5和大小都相同的其他照片 [(date, filename, fsid), ...]"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT fsid, filename, date FROM photos WHERE md5 = ? AND size = ? AND fsid != ?",
+                (md5, size, int(fsid)),
+            ).fetchall()
+        return [(row["date"], row["filename"], row["fsid"]) for row in rows]
+
+    def count_by_date(self, before=None, after=None):
+        """统计拍摄日期早于 before 或晚于 after (YYYY-MM-DD) 的照片数"""
+        if before:
+            sql, arg = "SELECT COUNT(*) FROM photos WHERE date < ?", before
+        else:
+            sql, arg = "SELECT COUNT(*) FROM photos WHERE date > ?", after
+        with self.lock:
+            return self.conn.execute(sql, (arg,)).fetchone()[0]
+
+    def known_fsids(self, fsids):
+        """返回给定 fsid 中已存在于目录里的那部分"""
+        fsids = [int(fsid) for fsid in fsids]
+        if not fsids:
+            return set()
+        placeholders = ",".join("?" * len(fsids))
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT fsid FROM photos WHERE fsid IN ({placeholders})", fsids
+            ).fetchall()
+        return {row["fsid"] for row in rows}
+
+    def get_meta(self, key, default=None):
+        """读取同步状态等元信息"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_meta(self, key, value):
+        """写入同步状态等元信息"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                (key, json.dumps(value, ensure_ascii=False)),
+            )
+
+    def delete_meta(self, key):
+        """删除元信息"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM meta WHERE key = ?", (key,))
+
+    def load_history(self):
+        """读取全部下载历史，返回 {file_id: 记录}"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT file_id, fsid, date, filename, hash, size, timestamp, mtime_ns, inode FROM history"
+            ).fetchall()
+        return {row["file_id"]: {key: row[key] for key in row.keys() if key != "file_id"} for row in rows}
+
+    def record_downloads(self, entries):
+        """逐条追加/更新下载历史 [(file_id, 记录), ...]，每次调用单独提交"""
+        rows = [
+            (file_id, entry.get("fsid"), entry.get("date"), entry.get("filename"),
+             entry.get("hash"), entry.get("size"), entry.get("timestamp"),
+             entry.get("mtime_ns"), entry.get("inode"))
+            for file_id, entry in entries
+        ]
+        with self.lock, self.conn:
+            self.conn.executemany(
+                """
+                INSERT OR REPLACE INTO history (file_id, fsid, date, filename, hash, size, timestamp, mtime_ns, inode)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+
+    def delete_history(self, file_ids):
+        """删除下载历史（如深度校验发现文件已损坏）"""
+        with self.lock, self.conn:
+            self.conn.executemany("DELETE FROM history WHERE file_id = ?", [(file_id,) for file_id in file_ids])
+
+    def import_history_json(self, history_path):
+        """一次性导入旧版 download_history.json"""
+        with open(history_path, 'r', encoding='utf-8') as f:
+            history = json.load(f)
+        self.record_downloads(history.items())
+        return len(history)
+
+    def load_failures(self):
+        """读取全部下载失败记录，返回 {file_id: 记录}"""
+        with self.lock:
+            rows = self.conn.execute("SELECT * FROM failed").fetchall()
+        return {row["file_id"]: {key: row[key] for key in row.keys() if key != "file_id"} for row in rows}
+
+    def record_failure(self, file_id, fsid, date, filename, error_class, error, retry_delay):
+        """记录一次下载失败：累加尝试次数，并记下最早可以重试的时间"""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                """
+                INSERT INTO failed (file_id, fsid, date, filename, attempts, error_class, error, next_retry_at, updated_at)
+                VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+                ON CONFLICT(file_id) DO UPDATE SET
+                    attempts = attempts + 1,
+                    error_class = excluded.error_class,
+                    error = excluded.error,
+                    next_retry_at = excluded.next_retry_at,
+                    updated_at = excluded.updated_at
+                """,
+                (file_id, fsid, date, filename, error_class, error, now + retry_delay, now),
+            )
+            row = self.conn.execute("SELECT * FROM failed WHERE file_id = ?", (file_id,)).fetchone()
+        return {key: row[key] for key in row.keys() if key != "file_id"}
+
+    def clear_failure(self, file_id):
+        """下载成功后删除失败记录"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM failed WHERE file_id = ?", (file_id,))
+
+    def import_failed_json(self, failed_path):
+        """一次性导入旧版 failed_downloads.json"""
+        with open(failed_path, 'r', encoding='utf-8') as f:
+            failed_history = json.load(f)
+        for file_id, entry in failed_history.items():
+            self.record_failure(file_id, entry.get("fsid"), entry.get("date"), entry.get("filename"),
+                                None, entry.get("error"), 0)
+        return len(failed_history)
+
+    def load_segments(self, file_id):
+        """读取大文件分段下载的进度 [{"idx", "start", "end", "done"}, ...]，没有记录时返回空列表"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT idx, start, end, done FROM segments WHERE file_id = ? ORDER BY idx", (file_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def save_segments(self, file_id, segments):
+        """保存新的分段计划，替换该文件原有的分段记录"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE file_id = ?", (file_id,))
+            self.conn.executemany(
+                "INSERT INTO segments (file_id, idx, start, end, done) VALUES (?, ?, ?, ?, ?)",
+                [(file_id, seg["idx"], seg["start"], seg["end"], seg["done"]) for seg in segments],
+            )
+
+    def update_segment(self, file_id, idx, done):
+        """更新单个分段已写入的字节数"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE segments SET done = ? WHERE file_id = ? AND idx = ?", (done, file_id, idx))
+
+    def delete_segments(self, file_id):
+        """文件下载完成后删除分段记录"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM segments WHERE file_id = ?", (file_id,))
+
+    def get_partial(self, file_id):
+        """未完成下载的 ETag 或 Last-Modified，续传时作为 If-Range，没有记录时返回 None"""
+        with self.lock:
+            row = self.conn.execute("SELECT validator FROM partials WHERE file_id = ?", (file_id,)).fetchone()
+        return row["validator"] if row else None
+
+    def save_partial(self, file_id, validator):
+        """记录未完成下载对应的服务器文件版本"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO partials (file_id, validator) VALUES (?, ?)", (file_id, validator)
+            )
+
+    def delete_partial(self, file_id):
+        """文件下载完成或重新开始后删除版本记录"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM partials WHERE file_id = ?", (file_id,))
+
+    def load_dlinks(self):
+        """读取缓存的下载链接 [(fsid, dlink, resolved_at), ...]"""
+        with self.lock:
+            rows = self.conn.execute("SELECT fsid, dlink, resolved_at FROM dlinks").fetchall()
+        return [(row["fsid"], row["dlink"], row["resolved_at"]) for row in rows]
+
+    def save_dlink(self, fsid, dlink, resolved_at, expires_at):
+        """缓存获取到的下载链接及其过期时间"""
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO dlinks (fsid, dlink, resolved_at, expires_at) VALUES (?, ?, ?, ?)",
+                (int(fsid), dlink, resolved_at, expires_at),
+            )
+
+    def delete_dlink(self, fsid):
+        """删除失效的下载链接"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dlinks WHERE fsid = ?", (int(fsid),))
+
+    def purge_dlinks(self, before):
+        """删除在 before 之前过期的下载链接"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM dlinks WHERE expires_at < ?", (before,))
+
+    def compact(self, truncate=False):
+        """把 WAL 日志合并回数据库文件；truncate=True 时同时清空日志文件"""
+        mode = "TRUNCATE" if truncate else "PASSIVE"
+        with self.lock:
+            self.conn.execute(f"PRAGMA wal_checkpoint({mode})")
+
+    def get_photo(self, fsid):
+        """按 fsid 读取完整的原始记录"""
+        with self.lock:
+            row = self.conn.execute("SELECT data FROM photos WHERE fsid = ?", (int(fsid),)).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def import_json_dir(self, json_path="./json/", batch_size=1000):
+        """一次性导入旧版 ./json/ 目录下的逐文件元数据"""
+        json_path = Path(json_path)
+        if not json_path.exists():
+            return 0, 0
+
+        imported = 0
+        failed = 0
+        batch = []
+        for file in json_path.glob("*.json"):
+            try:
+                with open(file, 'r', encoding='utf-8') as f:
+                    batch.append(self.photo_to_row(json.load(f)))
+            except Exception as e:
+                print(f"读取文件失败: {file.name}, 错误: {e}")
+                failed += 1
+                continue
+            if len(batch) >= batch_size:
+                imported += self.upsert_rows(batch)
+                batch = []
+        if batch:
+            imported += self.upsert_rows(batch)
+        return imported, failed
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+if __name__ == "__main__":
+    # 用法: python photographCatalog.py [json目录]，把旧版 ./json/ 导入 photos.db
+    source = sys.argv[1] if len(sys.argv) > 1 else "./json/"
+    catalog = photographCatalog()
+    imported, failed = catalog.import_json_dir(source)
+    print(f"✓ 导入完成！共导入 {imported} 条记录，失败 {failed} 条，目录中现有 {catalog.count()} 张照片")
+    catalog.close()
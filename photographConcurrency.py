@@ -0,0 +1,201 @@
+import asyncio
+import time
+from collections import deque
+from threading import Condition
+
+import requests
+
+# 被服务器限流的状态码
+THROTTLE_STATUS = (429, 503)
+
+
+def was_throttled(response):
+    """响应本身或 urllib3 在它之前的自动重试中是否遇到过限流"""
+    if response.status_code in THROTTLE_STATUS:
+        return True
+    retries = getattr(response.raw, "retries", None)
+    return any(h.status in THROTTLE_STATUS for h in getattr(retries, "history", ()) or ())
+
+
+def is_throttle_error(error):
+    """请求异常是否由限流引起（重试次数耗尽或最终返回 429/503）"""
+    if isinstance(error, requests.exceptions.RetryError):
+        return True
+    response = getattr(error, "response", None)
+    if response is not None:
+        return response.status_code in THROTTLE_STATUS
+    return getattr(error, "status", None) in THROTTLE_STATUS  # aiohttp.ClientResponseError
+
+
+# AIMD 并发控制：吞吐量上升时逐个增加并发，遇到限流或响应明显变慢时成倍减少
+class AdaptiveLimiter:
+    def __init__(self, name, initial=8, minimum=1, maximum=64, on_change=None):
+        self.name = name
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))  # 当前并发上限
+        self.on_change = on_change  # 并发上限变化时的回调，参数为 (name, limit, reason)
+        self.decrease_factor = 0.5  # 限流时的缩减比例
+        self.slowdown_factor = 0.75  # 响应变慢时的缩减比例
+        self.ttfb_tolerance = 2.0  # 首字节时间超过基线多少倍视为变慢
+        self.ttfb_slack = 0.05  # 首字节时间至少比基线多出的秒数，避免本地网络下的抖动误判
+        self.cooldown = 2.0  # 两次缩减之间至少间隔的秒数，避免同一批请求的反馈重复缩减
+        self.condition = Condition()
+        self.inflight = 0
+        self.waiters = deque()  # 等待名额的协程 (事件循环, Future)
+        self.saturated = False  # 本统计窗口内是否用满过并发上限
+        self.ttfb = None  # 首字节时间的指数移动平均
+        self.ttfb_baseline = None  # 观察到的最低首字节时间
+        self.last_rate = None
+        self.last_decrease = 0.0
+        self.reset_window(time.monotonic())
+
+    def configure(self, initial, minimum, maximum):
+        """按配置设置初始并发和上下限，需在开始下载前调用"""
+        with self.condition:
+            self.minimum = max(1, minimum)
+            self.maximum = max(self.minimum, maximum)
+            self.limit = max(self.minimum, min(initial, self.maximum))
+            self.condition.notify_all()
+            self.wake()
+
+    def reset_window(self, now):
+        self.window_start = now
+        self.window_amount = 0
+        self.window_count = 0
+        self.saturated = False
+
+    def take(self):
+        """占用一个名额（调用时需持有锁）"""
+        self.inflight += 1
+        if self.inflight >= self.limit:
+            self.saturated = True
+
+    def try_acquire(self):
+        with self.condition:
+            if self.inflight >= self.limit:
+                return False
+            self.take()
+            return True
+
+    def acquire(self):
+        with self.condition:
+            while self.inflight >= self.limit:
+                self.condition.wait()
+            self.take()
+
+    def release(self):
+        with self.condition:
+            self.inflight -= 1
+            self.wake()
+            self.condition.notify()
+
+    def wake(self):
+        """把空出的名额按顺序交给等待中的协程（调用时需持有锁）"""
+        while self.waiters and self.inflight < self.limit:
+            loop, future = self.waiters.popleft()
+            self.take()
+            try:
+                loop.call_soon_threadsafe(self.grant, future)
+            except RuntimeError:  # 事件循环已经关闭
+                self.inflight -= 1
+
+    def grant(self, future):
+        # 在等待者的事件循环中执行；协程已被取消时归还名额
+        if future.cancelled():
+            self.release()
+        else:
+            future.set_result(None)
+
+    async def acquire_async(self):
+        """asyncio 引擎使用：没有空位时等待 release 唤醒，不占用事件循环"""
+        with self.condition:
+            if self.inflight < self.limit and not self.waiters:
+                self.take()
+                return
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self.waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self.condition:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    granted = False
+                else:
+                    # 名额已经交给这个协程，但它在恢复运行前被取消
+                    granted = waiter[1].done() and not waiter[1].cancelled()
+            if granted:
+                self.release()
+            raise
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def set_limit(self, limit):
+        """修改并发上限，返回是否有变化（调用时需持有锁）"""
+        limit = max(self.minimum, min(limit, self.maximum))
+        if limit == self.limit:
+            return False
+        self.limit = limit
+        self.condition.notify_all()
+        self.wake()
+        return True
+
+    def record(self, amount=1, ttfb=None, throttled=False):
+        """记录一次完成的请求：amount 为传输的字节数（或请求数），ttfb 为首字节时间(秒)"""
+        reason = None
+        with self.condition:
+            now = time.monotonic()
+            if throttled:
+                if now - self.last_decrease >= self.cooldown:
+                    self.last_decrease = now
+                    if self.set_limit(int(self.limit * self.decrease_factor)):
+                        reason = "服务器限流"
+                    self.last_rate = None
+                    self.reset_window(now)
+            else:
+                if ttfb is not None:
+                    self.ttfb = ttfb if self.ttfb is None else self.ttfb * 0.8 + ttfb * 0.2
+                    if self.ttfb_baseline is None or self.ttfb < self.ttfb_baseline:
+                        self.ttfb_baseline = self.ttfb
+                self.window_amount += amount
+                self.window_count += 1
+                # 每完成约一轮（当前并发数个）请求评估一次
+                elapsed = now - self.window_start
+                if self.window_count >= self.limit and elapsed >= 0.5:
+                    reason = self.adjust(now, self.window_amount / elapsed)
+            limit = self.limit
+        if reason and self.on_change:
+            self.on_change(self.name, limit, reason)
+
+    def adjust(self, now, rate):
+        """每个统计窗口结束时调整并发上限，返回调整原因"""
+        reason = None
+        slow = (
+            self.ttfb_baseline
+            and self.ttfb > max(self.ttfb_baseline * self.ttfb_tolerance, self.ttfb_baseline + self.ttfb_slack)
+            and now - self.last_decrease >= self.cooldown
+        )
+        if slow:
+            self.last_decrease = now
+            if self.set_limit(int(self.limit * self.slowdown_factor)):
+                reason = f"响应变慢，首字节 {self.ttfb * 1000:.0f} ms"
+            # 缩减后重新建立基线，避免网络整体变慢后一直缩减
+            self.ttfb_baseline = self.ttfb
+        elif self.last_rate is not None and rate < self.last_rate * 0.9:
+            # 上次增加并发后吞吐量反而下降，退回一步
+            if self.set_limit(self.limit - 1):
+                reason = "吞吐量下降"
+        elif self.saturated:
+            # 并发用满且吞吐量没有下降，试探增加一个
+            if self.set_limit(self.limit + 1):
+                reason = "吞吐量上升"
+        self.last_rate = rate
+        self.reset_window(now)
+        return reason
@@ -0,0 +1,120 @@
+import os
+import shutil
+import threading
+
+from photographProgress import format_bytes
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，不支持 reflink
+    fcntl = None
+
+FICLONE = 0x40049409  # Linux 上 btrfs/XFS 等文件系统的写时复制克隆
+DEDUP_MODES = ("hardlink", "reflink", "copy", "off")
+
+
+def reflink(source, target):
+    """用写时复制克隆文件，文件系统不支持时抛出 OSError"""
+    if fcntl is None:
+        raise OSError("当前系统不支持 reflink")
+    with open(source, "rb") as src, open(target, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+# 按内容去重：同一张照片常以多个 fsid 出现（重新上传、不同设备的副本），
+# 已有本地副本时直接硬链接（或 reflink、复制）过来，不再传输；
+# 服务器没有提供MD5时，下载完成后按本地MD5合并重复文件，收回磁盘空间
+class ContentIndex:
+    def __init__(self, logger):
+        self.logger = logger
+        self.mode = "hardlink"  # hardlink=硬链接，reflink=写时复制，copy=复制，off=不去重
+        self.lock = threading.Lock()
+        self.local = {}  # (MD5, 大小) -> (已下载文件的路径, 修改时间, inode)，每次下载开始前从下载历史建立
+        self.linked = 0  # 从本地副本得到、没有传输的文件数
+        self.linked_bytes = 0
+        self.requests_saved = 0  # 省下的接口和下载请求数
+        self.reclaimed = 0  # 下载后合并的重复文件数
+        self.reclaimed_bytes = 0
+
+    @property
+    def enabled(self):
+        return self.mode != "off"
+
+    def configure(self, mode):
+        if mode not in DEDUP_MODES:
+            raise ValueError(f"dedup 只能是 {', '.join(DEDUP_MODES)} 之一: {mode}")
+        self.mode = mode
+
+    def clone(self, source, target, allow_copy=True):
+        """把 source 的内容放到 target：按配置依次尝试硬链接、reflink、复制，返回使用的方式。
+        先链接到临时文件再改名，target 上不会出现不完整的文件"""
+        temp = target.with_name(target.name + ".part")
+        temp.unlink(missing_ok=True)
+        methods = {"hardlink": ("hardlink", "reflink"), "reflink": ("reflink",)}.get(self.mode, ())
+        for method in methods:
+            try:
+                if method == "hardlink":
+                    os.link(source, temp)
+                else:
+                    reflink(source, temp)
+                break
+            except OSError:
+                # 跨分区、文件系统不支持等，换下一种方式
+                temp.unlink(missing_ok=True)
+        else:
+            if not allow_copy:
+                return None
+            method = "copy"
+            shutil.copyfile(source, temp)
+        os.replace(temp, target)
+        return method
+
+    def record_linked(self, size, requests):
+        with self.lock:
+            self.linked += 1
+            self.linked_bytes += size
+            self.requests_saved += requests
+
+    def load(self, history, save_path):
+        """从下载历史建立本地内容索引"""
+        index = {}
+        for entry in history.values():
+            if entry.get("hash") and entry.get("size") is not None:
+                path = save_path / entry["date"] / entry["filename"]
+                index[(entry["hash"], entry["size"])] = (path, entry.get("mtime_ns"), entry.get("inode"))
+        with self.lock:
+            self.local = index
+
+    def reclaim(self, path, file_hash, size):
+        """新下载的文件与已有文件内容相同时，改为指向已有文件，返回是否合并"""
+        if self.mode not in ("hardlink", "reflink"):
+            return False
+        key = (file_hash, size)
+        stat = path.stat()
+        with self.lock:
+            existing, mtime_ns, inode = self.local.setdefault(key, (path, stat.st_mtime_ns, stat.st_ino))
+        if existing == path or inode == stat.st_ino:
+            return False
+        try:
+            current = existing.stat()
+            changed = (current.st_size, current.st_mtime_ns, current.st_ino) != (size, mtime_ns, inode)
+        except OSError:
+            changed = True
+        if changed:
+            # 已有文件不存在或下载后被修改过，以新文件为准
+            with self.lock:
+                self.local[key] = (path, stat.st_mtime_ns, stat.st_ino)
+            return False
+        if not self.clone(existing, path, allow_copy=False):
+            return False
+        with self.lock:
+            self.reclaimed += 1
+            self.reclaimed_bytes += size
+        return True
+
+    def summary(self):
+        return (
+            f"重复内容: {self.linked} 个文件从本地副本{'链接' if self.mode != 'copy' else '复制'}，"
+            f"节省传输 {format_bytes(self.linked_bytes)}、请求 {self.requests_saved} 次；"
+            f"下载后合并 {self.reclaimed} 个重复文件，释放 {format_bytes(self.reclaimed_bytes)}"
+        )
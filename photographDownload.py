@@ -1,59 +1,96 @@
+import argparse
 import hashlib
+import itertools
 import json
 import logging
+import os
+import re
 import sys
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from threading import Lock
 
-import requests
-from requests.adapters import HTTPAdapter
 from tqdm import tqdm
-from urllib3.util.retry import Retry
+from urllib3.exceptions import IncompleteRead
+
+from photographBandwidth import BandwidthLimiter
+from photographCatalog import photographCatalog
+from photographConcurrency import AdaptiveLimiter, is_throttle_error, was_throttled
+from photographDedup import ContentIndex
+from photographDisk import DirectoryCache, SyncPolicy, preallocate
+from photographLinks import DlinkExpiredError, LinkResolver, is_link_expired
+from photographLogging import setup_logging
+from photographProgress import ProgressReporter
+from photographScheduler import (
+    AUTH_ERROR_CODES, NOT_FOUND_ERROR_CODES, SCHEDULE_POLICIES, AuthError, PermanentError, RetryScheduler,
+    interleave_by_size, retry_delay,
+)
+from photographSession import BufferPool, RangeNotSupportedError, TransportStats, create_session
+
+# 单个文件下载成功日志的输出方式
+SUCCESS_LOG_MODES = ("all", "sample", "summary")
 
 
 class photographDownload:
     def __init__(self):
-        # 设置日志
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - [%(threadName)s] - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('download.log', encoding='utf-8'),
-                logging.StreamHandler()
-            ]
-        )
+        # 设置日志：下载线程只把日志放入队列，由日志线程写入文件和终端
+        setup_logging('download.log')
         self.logger = logging.getLogger(__name__)
-        # 设置请求会话 - 增加连接池大小以匹配并发线程数
-        self.session = requests.Session()
-        retry_strategy = Retry(
-            total=3,
-            backoff_factor=1,
-            status_forcelist=[429, 500, 502, 503, 504]
-        )
-        # 设置连接池大小为40，匹配32个并发线程
-        adapter = HTTPAdapter(
-            max_retries=retry_strategy,
-            pool_connections=40,  # 连接池数量
-            pool_maxsize=40       # 每个连接池的最大连接数
-        )
-        self.session.mount("https://", adapter)
-        self.session.mount("http://", adapter)
+        self.success_log = "sample"  # 单个文件下载成功的日志: all=全部输出，sample=抽样输出，summary=只输出汇总
+        self.success_log_every = 100  # 抽样时每成功多少个文件输出一条
+        self.success_count = itertools.count(1)
+        # 设置请求会话 - check_auth 读取配置后按并发数重建连接池
+        self.transport_stats = TransportStats()
+        self.session = create_session(stats=self.transport_stats)
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
         }
         self.URL = "https://photo.baidu.com/youai/file/v2/download"
-        self.json_path = Path("./json/")  # 存储图片元数据的路径
+        self.json_path = Path("./json/")  # 旧版逐文件元数据目录，仅用于迁移
+        self.catalog = photographCatalog()  # 照片元数据目录
+        self.links = LinkResolver(self.resolve_dlink, self.catalog, self.logger)  # 下载链接的预取和缓存
+        self.dedup = ContentIndex(self.logger)  # 按内容去重
         self.save_path = Path("./photograph/")  # 存储下载图片的路径
         self.clienttype = None
         self.bdstoken = None
+        self.config = {}  # settings.json 中的配置，check_auth 时读取
         self.failed_photos = set()  # 存储下载失败的照片文件名
-        self.download_history = Path("./download_history.json")  # 下载历史文件
-        self.failed_downloads = Path("./failed_downloads.json")  # 保存下载失败文件的记录
-        self.max_workers = 32  # 并发下载数
+        self.download_history = Path("./download_history.json")  # 旧版下载历史文件，仅用于迁移
+        self.failed_downloads = Path("./failed_downloads.json")  # 旧版下载失败记录，仅用于迁移
+        self.max_attempts = 5  # 每个文件连续失败的最多次数，累计以前运行中的失败，用尽后每次运行只再尝试一次
+        self.retry_base_delay = 2.0  # 第一次重试前的等待(秒)，之后每次翻倍并加随机抖动
+        self.retry_max_delay = 300.0  # 重试等待的上限(秒)
+        self.max_workers = 32  # 下载线程数，开启自适应并发时按两个并发上限之和设置
+        self.scan_workers = 8  # 检查待下载文件的线程数
+        self.scan_batch_size = 256  # 每个扫描任务检查的文件数
+        self.schedule_policy = "newest"  # 下载顺序，见 SCHEDULE_POLICIES
+        self.adaptive_concurrency = True  # 根据限流、响应时间和吞吐量自动调整并发
+        self.on_concurrency_change = None  # 并发上限变化时的回调，参数为 (name, limit)
+        # 获取下载链接和传输文件内容分别限制并发
+        self.link_limiter = AdaptiveLimiter("下载链接", initial=8, maximum=32, on_change=self.report_concurrency)
+        self.transfer_limiter = AdaptiveLimiter("文件传输", initial=16, maximum=64, on_change=self.report_concurrency)
+        # 所有下载线程共用的进度条
+        self.progress = ProgressReporter(self.logger, inflight=lambda: self.transfer_limiter.inflight)
         self.chunk_size = 1024 * 512  # 下载块大小
+        self.use_readinto = True  # 直接读入复用的缓冲区，不为每个下载块分配新的 bytes
+        self.buffers = BufferPool(self.chunk_size)
+        self.write_buffer = 1024 * 1024  # 写文件的缓冲区大小，几个下载块合并为一次写入
+        self.preallocate = True  # 按 Content-Length 预留磁盘空间，减少同时写入多个文件时的碎片
+        self.directories = DirectoryCache()  # 已创建的日期目录
+        self.sync = SyncPolicy()  # 下载完成时是否 fsync
+        self.bandwidth = BandwidthLimiter(on_change=self.report_bandwidth)  # 所有下载线程共用的带宽限制
         self.max_file_size = 500 * 1024 * 1024  # 最大文件大小限制(500MB)
+        self.segment_threshold = 64 * 1024 * 1024  # 超过该大小的文件分段并发下载
+        self.segment_count = 4  # 每个大文件同时下载的分段数
+        self.segments_supported = True  # 下载服务器是否支持 Range，发现不支持后本次运行不再分段
+        self.verify_md5 = True  # 下载后与列表元数据中的MD5比对
+        self.md5_matches = 0  # 与服务器MD5一致的文件数
+        self.md5_mismatches = 0  # 与服务器MD5不一致的文件数
+        self.checksum_lock = Lock()
+        self.compact_interval = 1000  # 每完成多少个文件合并一次下载历史的 WAL 日志
+        self.completed_since_compact = 0
         
         # 线程锁保护字典操作
         self.history_lock = Lock()
@@ -61,56 +98,92 @@ class photographDownload:
 
         # 创建必要的目录
         self.save_path.mkdir(parents=True, exist_ok=True)
-        self.json_path.mkdir(parents=True, exist_ok=True)
 
         # 加载下载历史和失败记录
         self.failed_history = self.load_failed_downloads()
         self.history = self.load_download_history()
 
     def load_download_history(self):
-        """加载下载历史记录"""
+        """加载下载历史记录，首次运行时导入旧版 download_history.json"""
         self.logger.info("加载load_download_history")
         try:
-            if self.download_history.exists():
-                with open(self.download_history, 'r', encoding='utf-8') as f:
-                    history = json.load(f)
-                    return history
-            return {}
+            if self.download_history.exists() and not self.catalog.get_meta("history_imported"):
+                count = self.catalog.import_history_json(self.download_history)
+                self.catalog.set_meta("history_imported", True)
+                self.logger.info(f"已从 {self.download_history} 导入 {count} 条下载历史")
+            return self.catalog.load_history()
         except Exception as e:
             self.logger.error(f"加载下载历史失败: {e}")
             return {}
 
     def load_failed_downloads(self):
-        """加载下载失败文件记录"""
+        """加载下载失败文件记录，首次运行时导入旧版 failed_downloads.json"""
         self.logger.info("加载load_failed_downloads")
         try:
-            if self.failed_downloads.exists():
-                with open(self.failed_downloads, 'r', encoding='utf-8') as f:
-                    failed_history = json.load(f)
-                    return failed_history
-            return {}
+            if self.failed_downloads.exists() and not self.catalog.get_meta("failed_imported"):
+                count = self.catalog.import_failed_json(self.failed_downloads)
+                self.catalog.set_meta("failed_imported", True)
+                self.logger.info(f"已从 {self.failed_downloads} 导入 {count} 条失败记录")
+            return self.catalog.load_failures()
         except Exception as e:
             self.logger.error(f"加载失败文件记录失败: {e}")
             return {}
 
-    def save_download_history(self):
-        """保存下载历史记录"""
+    def record_failure(self, file_id, date, filename, fsid, error):
+        """记录一次下载失败，只更新这一条记录；下次可以重试的时间与重试调度器使用同一套退避"""
+        attempts = (self.failed_history.get(file_id, {}).get("attempts") or 0) + 1
+        delay = retry_delay(attempts, self.retry_base_delay, self.retry_max_delay)
         try:
-            with self.history_lock:
-                with open(self.download_history, 'w', encoding='utf-8') as f:
-                    json.dump(self.history, f, ensure_ascii=False, indent=2)
+            entry = self.catalog.record_failure(
+                file_id, fsid, date, filename, type(error).__name__, str(error), delay
+            )
+            with self.failed_lock:
+                self.failed_history[file_id] = entry
         except Exception as e:
-            self.logger.error(f"保存下载历史失败: {e}")
+            self.logger.error(f"保存失败文件记录失败: {e}")
 
-    def save_failed_downloads(self):
-        """保存失败的文件记录"""
+    def retry_state(self, item):
+        """失败记录中的 (累计失败次数, 距可以重试还需等待的秒数)，没有失败记录时为 (0, 0)"""
+        date, filename, fsid = item
+        entry = self.failed_history.get(f"{date}_{Path(filename).name}_{fsid}")
+        if not entry:
+            return 0, 0.0
+        return entry.get("attempts") or 0, max(0.0, (entry.get("next_retry_at") or 0) - time.time())
+
+    def clear_failure(self, file_id):
+        """下载成功后删除失败记录"""
+        with self.failed_lock:
+            if file_id not in self.failed_history:
+                return
+            del self.failed_history[file_id]
         try:
-            with self.failed_lock:
-                with open(self.failed_downloads, 'w', encoding='utf-8') as f:
-                    json.dump(self.failed_history, f, ensure_ascii=False, indent=2)
+            self.catalog.clear_failure(file_id)
         except Exception as e:
             self.logger.error(f"保存失败文件记录失败: {e}")
 
+    def record_download(self, file_id, entry):
+        """追加一条下载历史，完成一个文件只写一条记录"""
+        with self.history_lock:
+            self.history[file_id] = entry
+            self.completed_since_compact += 1
+            compact = self.completed_since_compact >= self.compact_interval
+            if compact:
+                self.completed_since_compact = 0
+        try:
+            self.catalog.record_downloads([(file_id, entry)])
+            if compact:
+                self.catalog.compact()
+        except Exception as e:
+            self.logger.error(f"保存下载历史失败: {e}")
+
+    def save_download_history(self):
+        """下载历史已逐条写入，这里把 fsync=batch 时剩余的文件写入磁盘，并合并清空 WAL 日志"""
+        try:
+            self.sync.flush()
+            self.catalog.compact(truncate=True)
+        except Exception as e:
+            self.logger.error(f"保存下载历史失败: {e}")
+
     def validate_config(self, config):
         """验证配置信息"""
         required_fields = ["clienttype", "bdstoken", "Cookie"]
@@ -138,6 +211,30 @@ class photographDownload:
         """检查认证信息"""
         try:
             config = self.load_config()
+            self.config = config
+            self.configure_concurrency(config)
+            self.configure_bandwidth(config)
+            self.links.configure(config, self.link_limiter.maximum)
+            self.progress.log_interval = float(config.get("progress_log_interval", self.progress.log_interval))
+            self.success_log = config.get("log_success", self.success_log)
+            if self.success_log not in SUCCESS_LOG_MODES:
+                raise ValueError(f"log_success 只能是 {', '.join(SUCCESS_LOG_MODES)} 之一: {self.success_log}")
+            self.success_log_every = max(1, int(config.get("log_success_every", self.success_log_every)))
+            # 连接池按同时进行的请求数设置，留出余量
+            self.session = create_session({"http_pool_size": self.max_workers + 8, **config}, self.transport_stats)
+            self.verify_md5 = config.get("verify_md5", True)
+            self.segment_threshold = int(config.get("segment_threshold", self.segment_threshold))
+            self.segment_count = int(config.get("segment_count", self.segment_count))
+            self.scan_workers = int(config.get("scan_workers", self.scan_workers))
+            self.configure_policy(config.get("schedule_policy", self.schedule_policy))
+            self.dedup.configure(config.get("dedup", self.dedup.mode))
+            self.write_buffer = int(config.get("write_buffer", self.write_buffer))
+            self.use_readinto = config.get("readinto", self.use_readinto)
+            self.preallocate = config.get("preallocate", self.preallocate)
+            self.sync.configure(config.get("fsync", self.sync.mode), config.get("fsync_batch"))
+            self.max_attempts = max(1, int(config.get("max_attempts", self.max_attempts)))
+            self.retry_base_delay = float(config.get("retry_base_delay", self.retry_base_delay))
+            self.retry_max_delay = float(config.get("retry_max_delay", self.retry_max_delay))
             self.clienttype = config["clienttype"]
             self.bdstoken = config["bdstoken"]
             self.headers["Cookie"] = config["Cookie"]
@@ -157,66 +254,524 @@ class photographDownload:
             self.logger.error(f"认证检查失败: {str(e)}")
             sys.exit(1)
 
+    def configure_concurrency(self, config):
+        """按配置设置两个并发上限；关闭自适应时都固定为线程数"""
+        self.adaptive_concurrency = config.get("adaptive_concurrency", True)
+        for limiter, key in ((self.link_limiter, "link_concurrency"), (self.transfer_limiter, "transfer_concurrency")):
+            if self.adaptive_concurrency:
+                limiter.configure(
+                    int(config.get(key, limiter.limit)),
+                    int(config.get(f"{key}_min", limiter.minimum)),
+                    int(config.get(f"{key}_max", limiter.maximum)),
+                )
+            else:
+                limiter.configure(self.max_workers, self.max_workers, self.max_workers)
+        if self.adaptive_concurrency:
+            self.max_workers = self.link_limiter.maximum + self.transfer_limiter.maximum
+        for limiter in (self.link_limiter, self.transfer_limiter):
+            self.report_concurrency(limiter.name, limiter.limit, "初始值" if self.adaptive_concurrency else "固定")
+
+    def configure_policy(self, policy):
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError(f"schedule_policy 只能是 {', '.join(SCHEDULE_POLICIES)} 之一: {policy}")
+        self.schedule_policy = policy
+
+    def report_concurrency(self, name, limit, reason):
+        """并发上限变化时写日志并通知界面"""
+        self.logger.info(f"{name}并发上限: {limit}（{reason}）")
+        if self.on_concurrency_change:
+            self.on_concurrency_change(name, limit)
+
+    def configure_bandwidth(self, config):
+        """按配置设置带宽上限和限速时间段"""
+        try:
+            self.bandwidth.configure(config.get("bandwidth_limit", 0), config.get("bandwidth_schedule"))
+        except (KeyError, TypeError, ValueError) as e:
+            self.logger.error(f"带宽限制配置错误，不限速: {e}")
+            self.bandwidth.configure()
+
+    def report_bandwidth(self, rate):
+        """生效的带宽上限变化时写日志"""
+        if rate:
+            self.logger.info(f"带宽上限: {rate / 1024 / 1024:.2f} MB/s")
+        else:
+            self.logger.info("带宽上限: 不限速")
+
+    def iter_chunks(self, response):
+        """逐块读取响应内容。响应未经压缩时绕过 urllib3 的 read()（每次都分配新的 bytes 再复制），
+        直接 readinto 到从缓冲区池借来的缓冲区，返回指向缓冲区的 memoryview，写文件和计算MD5都不再复制；
+        调用方必须在取下一块之前用完上一块"""
+        body = getattr(response.raw, "_fp", None)
+        if (not self.use_readinto or not hasattr(body, "readinto")
+                or response.headers.get("Content-Encoding", "identity") != "identity"):
+            yield from response.iter_content(chunk_size=self.chunk_size)
+            return
+        # 绕过了 urllib3 对 Content-Length 的检查，需要自己判断连接是否提前断开；分块传输时为 None
+        expected = getattr(body, "length", None)
+        received = 0
+        buffer = self.buffers.acquire()
+        try:
+            view = memoryview(buffer)
+            while True:
+                size = body.readinto(buffer)
+                if not size:
+                    if expected is not None and received < expected:
+                        raise IncompleteRead(received, expected - received)
+                    # 让 urllib3 发现响应已读完，把连接放回连接池复用
+                    response.raw.read()
+                    return
+                received += size
+                yield view[:size]
+        finally:
+            self.buffers.release(buffer)
+
+    def update_hash_from_file(self, hash_md5, filepath):
+        """把文件内容读入哈希对象"""
+        buffer = self.buffers.acquire()
+        try:
+            view = memoryview(buffer)
+            with open(filepath, "rb", buffering=0) as f:
+                while True:
+                    size = f.readinto(buffer)
+                    if not size:
+                        return hash_md5
+                    hash_md5.update(view[:size])
+        finally:
+            self.buffers.release(buffer)
+
     def calculate_file_hash(self, filepath):
         """计算文件的MD5哈希值"""
-        hash_md5 = hashlib.md5()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
-
-    def download_with_resume(self, url, filepath, file_size=None):
-        """支持断点续传的下载函数"""
+        return self.update_hash_from_file(hashlib.md5(), filepath).hexdigest()
+
+    @staticmethod
+    def part_path(filepath):
+        """未完成的下载写入同目录下的 .part 文件，校验通过后才改名为目标文件"""
+        return filepath.with_name(filepath.name + ".part")
+
+    @staticmethod
+    def response_validator(headers):
+        """响应中可用于 If-Range 的文件版本：强 ETag，没有时用 Last-Modified"""
+        etag = headers.get("ETag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return headers.get("Last-Modified")
+
+    def range_headers(self, file_id, start, end=None):
+        """续传的请求头；记录过文件版本时带上 If-Range，服务器上的文件变化后会返回完整内容而不是错位的片段"""
         headers = self.headers.copy()
-        mode = 'ab'
-
-        if filepath.exists():
-            current_size = filepath.stat().st_size
-            if file_size and current_size >= file_size:
-                return True
-            headers["Range"] = f"bytes={current_size}-"
-        else:
+        headers["Range"] = f"bytes={start}-{'' if end is None else end}"
+        validator = self.catalog.get_partial(file_id) if file_id else None
+        if validator:
+            headers["If-Range"] = validator
+        return headers
+
+    @staticmethod
+    def check_content_range(content_range, start, file_size=None):
+        """校验206响应的 Content-Range 与请求的起始位置和文件大小一致，返回 (起始, 结束)"""
+        match = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+|\*)", (content_range or "").strip())
+        if not match:
+            raise ValueError(f"206响应的 Content-Range 无效: {content_range}")
+        first, last, total = int(match.group(1)), int(match.group(2)), match.group(3)
+        if first != start:
+            raise ValueError(f"服务器返回的范围与请求不一致: {content_range}，请求从 {start} 开始")
+        if file_size and total != "*" and int(total) != file_size:
+            raise ValueError(f"服务器返回的文件大小与元数据不一致: {content_range} != {file_size}")
+        return first, last
+
+    def download_with_resume(self, url, filepath, file_size=None, file_id=None):
+        """支持断点续传的下载函数，filepath 为 .part 文件，边下载边计算MD5，成功时返回哈希值，失败时抛出异常。
+        续传只接受范围正确的206响应；服务器返回200时说明不支持续传或文件已变化，从头写入"""
+        hash_md5 = hashlib.md5()
+        current_size = filepath.stat().st_size if filepath.exists() else 0
+        if file_size and current_size >= file_size:
+            # 没有记录能证明完整大小的 .part 是本程序完整写入的（可能是校验失败或被 --deep-verify 剔除的文件），从头下载
+            filepath.unlink()
+            if file_id:
+                self.catalog.delete_partial(file_id)
             current_size = 0
-            mode = 'wb'
+        if current_size:
+            # 续传时只读一遍已有的部分，之后对新数据增量计算
+            self.update_hash_from_file(hash_md5, filepath)
+            headers = self.range_headers(file_id, current_size)
+        else:
+            headers = self.headers.copy()
+        resumed_from = current_size
 
         try:
-            with self.session.get(url, headers=headers, stream=True) as response:
+            with self.transfer_limiter, self.session.get(url, headers=headers, stream=True) as response:
+                if response.status_code == 416:
+                    # 已下载的部分超出了服务器上的文件，下次从头下载
+                    filepath.unlink(missing_ok=True)
+                    if "If-Range" in headers:
+                        self.catalog.delete_partial(file_id)
                 response.raise_for_status()
+                validator = self.response_validator(response.headers)
+                if current_size and response.status_code == 206:
+                    self.check_content_range(response.headers.get("Content-Range"), current_size, file_size)
+                    mode = 'ab'
+                else:
+                    if current_size:
+                        self.logger.info(f"{filepath.name} 无法续传（状态码 {response.status_code}），从头下载")
+                        if "If-Range" in headers:
+                            self.catalog.delete_partial(file_id)
+                            headers.pop("If-Range")
+                        hash_md5 = hashlib.md5()
+                        current_size = resumed_from = 0
+                    mode = 'wb'
                 total_size = int(response.headers.get('content-length', 0)) + current_size
 
                 if total_size > self.max_file_size:
-                    raise ValueError(f"文件大小超过限制: {total_size} > {self.max_file_size}")
-
-                with open(filepath, mode) as f:
-                    with tqdm(
-                        total=total_size,
-                        initial=current_size,
-                        unit='iB',
-                        unit_scale=True,
-                        unit_divisor=1024,
-                        desc=filepath.name
-                    ) as pbar:
-                        for chunk in response.iter_content(chunk_size=self.chunk_size):
-                            if chunk:
-                                size = f.write(chunk)
-                                pbar.update(size)
-            return True
+                    raise PermanentError(f"文件大小超过限制: {total_size} > {self.max_file_size}")
+                if file_size and 'content-length' in response.headers and total_size != file_size:
+                    raise ValueError(f"服务器返回的大小与元数据不一致: {total_size} != {file_size}")
+                # 收到响应头就记下文件版本，进程中途被结束时下次续传也能用 If-Range 确认服务器上的文件没有变化
+                if file_id and validator and headers.get("If-Range") != validator:
+                    self.catalog.save_partial(file_id, validator)
+
+                with open(filepath, mode, buffering=self.write_buffer) as f:
+                    if self.preallocate:
+                        preallocate(f.fileno(), current_size, total_size - current_size)
+                    for chunk in self.iter_chunks(response):
+                        if chunk:
+                            self.bandwidth.consume(len(chunk))
+                            size = f.write(chunk)
+                            hash_md5.update(chunk)
+                            self.progress.add_bytes(size)
+                            current_size += size
+                            if file_size and current_size > file_size:
+                                raise ValueError(f"下载的数据超过元数据中的大小: {file_size}")
+                self.transfer_limiter.record(
+                    current_size - resumed_from, response.elapsed.total_seconds(), was_throttled(response)
+                )
+            if file_id and (validator or "If-Range" in headers):
+                self.catalog.delete_partial(file_id)
+            return hash_md5.hexdigest()
         except Exception as e:
-            self.logger.error(f"下载失败 {filepath.name}: {str(e)}")
-            return False
+            if is_link_expired(e):
+                raise DlinkExpiredError(str(e)) from e
+            if is_throttle_error(e):
+                self.transfer_limiter.record(throttled=True)
+            raise
+
+    def use_segments(self, file_size, file_id):
+        """是否对该文件使用分段下载：大小已知且超过阈值，服务器支持 Range"""
+        return bool(file_id and file_size and self.segments_supported and self.segment_count > 1
+                    and file_size >= self.segment_threshold)
+
+    def plan_segments(self, filepath, file_size, file_id):
+        """读取或新建分段计划；已有不完整的单连接下载时，从已下载的位置开始分段"""
+        current_size = filepath.stat().st_size if filepath.exists() else 0
+        segments = self.catalog.load_segments(file_id)
+        if current_size == file_size and segments:
+            # 预分配前一定先保存了分段计划，按计划中记录的进度继续
+            return segments
+
+        # 没有分段记录时，已有的文件只可能是单连接下载的前缀；
+        # 完整大小却没有计划的文件无法确认内容完整，从头下载
+        offset = current_size if current_size < file_size else 0
+        remaining = file_size - offset
+        count = max(1, min(self.segment_count, remaining // self.chunk_size or 1))
+        segment_size = -(-remaining // count)
+        segments = [
+            {"idx": i, "start": offset + i * segment_size,
+             "end": min(offset + (i + 1) * segment_size, file_size) - 1, "done": 0}
+            for i in range(count)
+        ]
+        # 先保存计划再预分配，避免中断后把预分配的文件当成已下载完整
+        self.catalog.save_segments(file_id, segments)
+        with open(filepath, 'r+b' if offset else 'wb') as f:
+            # 计划已保存，可以直接把文件扩展到完整大小并一次预留全部空间，各分段不会交错成碎片
+            if not (self.preallocate and preallocate(f.fileno(), offset, file_size - offset, keep_size=False)):
+                f.truncate(file_size)
+        return segments
+
+    def download_segment(self, url, filepath, file_id, segment):
+        """下载一个分段，写入预分配文件中对应的位置，逐块保存进度"""
+        position = segment["start"] + segment["done"]
+        if position > segment["end"]:
+            return
+        headers = self.range_headers(file_id, position, segment["end"])
+        received = 0
+        with self.transfer_limiter, self.session.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                if "If-Range" in headers:
+                    # 服务器上的文件已变化，已下载的分段作废
+                    self.catalog.delete_segments(file_id)
+                    self.catalog.delete_partial(file_id)
+                    filepath.unlink(missing_ok=True)
+                    raise ValueError("服务器上的文件已变化，重新下载")
+                # 直接关闭响应，不读取完整的文件内容
+                raise RangeNotSupportedError(f"服务器不支持分段下载，返回状态码 {response.status_code}")
+            self.check_content_range(response.headers.get("Content-Range"), position)
+            if "If-Range" not in headers:
+                validator = self.response_validator(response.headers)
+                if validator:
+                    self.catalog.save_partial(file_id, validator)
+            # 每个分段使用自己的文件句柄，定位后顺序写入，各段直接写进最终文件，不需要再拼接
+            with open(filepath, 'r+b') as f:
+                f.seek(position)
+                for chunk in self.iter_chunks(response):
+                    if not chunk:
+                        continue
+                    if position + len(chunk) > segment["end"] + 1:
+                        raise ValueError(f"分段 {segment['idx']} 返回的数据超过请求的范围")
+                    self.bandwidth.consume(len(chunk))
+                    f.write(chunk)
+                    f.flush()
+                    self.progress.add_bytes(len(chunk))
+                    position += len(chunk)
+                    received += len(chunk)
+                    segment["done"] = position - segment["start"]
+                    self.catalog.update_segment(file_id, segment["idx"], segment["done"])
+            self.transfer_limiter.record(received, response.elapsed.total_seconds(), was_throttled(response))
+        if position != segment["end"] + 1:
+            raise ValueError(f"分段 {segment['idx']} 不完整: {position - segment['start']} / {segment['end'] - segment['start'] + 1}")
+
+    def download_segmented(self, url, filepath, file_size, file_id):
+        """大文件分段并发下载，每个分段可以单独续传；成功时返回MD5，失败时抛出异常"""
+        try:
+            if file_size > self.max_file_size:
+                raise PermanentError(f"文件大小超过限制: {file_size} > {self.max_file_size}")
+            segments = self.plan_segments(filepath, file_size, file_id)
+            pending = [seg for seg in segments if seg["start"] + seg["done"] <= seg["end"]]
+            if pending:
+                self.logger.info(f"分段下载 {filepath.name}: {len(pending)}/{len(segments)} 个分段待下载")
+                try:
+                    with ThreadPoolExecutor(max_workers=len(pending), thread_name_prefix="Segment") as executor:
+                        futures = [executor.submit(self.download_segment, url, filepath, file_id, seg)
+                                   for seg in pending]
+                        for future in futures:
+                            future.result()
+                except RangeNotSupportedError as e:
+                    return self.download_unsegmented(url, filepath, file_size, file_id, segments, e)
+
+            size = filepath.stat().st_size
+            if size != file_size:
+                raise ValueError(f"分段下载后文件大小不一致: {size} != {file_size}")
+            # 各分段乱序写入，完成后统一计算一次MD5
+            file_hash = self.calculate_file_hash(filepath)
+            self.catalog.delete_segments(file_id)
+            self.catalog.delete_partial(file_id)
+            return file_hash
+        except Exception as e:
+            if is_link_expired(e):
+                raise DlinkExpiredError(str(e)) from e
+            if is_throttle_error(e):
+                self.transfer_limiter.record(throttled=True)
+            raise
+
+    def download_unsegmented(self, url, filepath, file_size, file_id, segments, error):
+        """服务器不支持 Range 时放弃分段计划，改用单连接下载这个文件，本次运行之后的文件也不再分段"""
+        if self.segments_supported:
+            self.segments_supported = False
+            self.logger.warning(f"{error}，本次运行改用单连接下载大文件")
+        self.catalog.delete_segments(file_id)
+        # 只保留第一个分段之前连续写入的部分，预分配的空白区域不能当作已下载的数据
+        with open(filepath, 'r+b') as f:
+            f.truncate(segments[0]["start"] + segments[0]["done"])
+        return self.download_with_resume(url, filepath, file_size, file_id)
+
+    def verify_checksum(self, filepath, file_hash, expected_size, expected_md5):
+        """与列表元数据中服务器提供的大小和MD5比对，一致时返回None，否则返回原因"""
+        size = filepath.stat().st_size
+        if expected_size and size != expected_size:
+            return f"文件大小不一致: {size} != {expected_size}"
+        if not self.verify_md5 or not expected_md5 or len(expected_md5) != 32:
+            return None
+
+        with self.checksum_lock:
+            if file_hash == expected_md5.lower():
+                self.md5_matches += 1
+                return None
+            self.md5_mismatches += 1
+            # 大小一致但MD5从未对上过，说明服务器的md5字段不是文件内容的MD5，停止比对以免反复重下
+            if self.md5_matches == 0 and self.md5_mismatches >= 3:
+                if self.verify_md5:
+                    self.logger.warning("服务器提供的MD5与文件内容始终不一致，本次运行不再比对MD5，只校验文件大小")
+                self.verify_md5 = False
+                return None
+        return f"MD5不一致: {file_hash} != {expected_md5}"
+
+    def download_verified(self, url, filepath, expected_size=None, expected_md5=None, file_id=None):
+        """下载到 .part 文件并校验，通过后原子地改名为 filepath；
+        与服务器的大小或MD5不一致时删除文件立即重新下载一次"""
+        part = self.prepare_part(filepath, expected_size)
+        for attempt in range(2):
+            if self.use_segments(expected_size, file_id):
+                file_hash = self.download_segmented(url, part, expected_size, file_id)
+            else:
+                file_hash = self.download_with_resume(url, part, expected_size, file_id)
+            mismatch = self.verify_checksum(part, file_hash, expected_size, expected_md5)
+            if not mismatch:
+                self.commit_part(part, filepath)
+                return file_hash
+            self.logger.warning(f"{filepath.name} 校验失败（{mismatch}），删除后重新下载")
+            part.unlink(missing_ok=True)
+        raise ValueError(f"重新下载后校验仍然失败: {mismatch}")
+
+    def commit_part(self, part, filepath):
+        """校验通过的 .part 按 fsync 策略写入磁盘后，原子地改名为正式文件"""
+        self.sync.before_rename(part)
+        os.replace(part, filepath)
+        self.sync.completed(filepath)
+
+    def prepare_part(self, filepath, expected_size=None):
+        """返回 filepath 对应的 .part 文件；旧版本直接写入目标文件的未完成下载改名为 .part 后继续。
+        调用时目标文件已经校验不通过，只有小于服务器记录大小的文件才可能是未完成的下载"""
+        part = self.part_path(filepath)
+        if not part.exists() and filepath.exists():
+            stat = filepath.stat()
+            if stat.st_nlink == 1 and expected_size and stat.st_size < expected_size:
+                os.replace(filepath, part)
+            else:
+                # 完整大小的文件已损坏（或大小未知无法判断），与其他照片共用内容的硬链接也不能在原处续写，删除后重新下载
+                filepath.unlink()
+        return part
+
+    @staticmethod
+    def stat_signature(stat):
+        """用于快速校验的文件状态 (大小, 修改时间, inode)"""
+        return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "inode": stat.st_ino}
 
     def validate_downloaded_file(self, file_id, save_path):
-        """校验下载的文件完整性"""
-        if not save_path.exists():
+        """校验下载的文件完整性：文件状态与记录一致时直接通过，否则重新计算哈希"""
+        entry = self.history.get(file_id)
+        if not entry:
+            return False
+        try:
+            stat = save_path.stat()
+        except OSError:
+            return False
+
+        signature = self.stat_signature(stat)
+        if all(entry.get(key) == value for key, value in signature.items()):
+            return True
+
+        # 文件状态变化（或旧版记录没有文件状态），读一遍文件确认内容没变，并更新记录
+        if self.calculate_file_hash(save_path) != entry.get('hash'):
             return False
-        if file_id in self.history:
-            expected_hash = self.history[file_id].get('hash')
-            if self.calculate_file_hash(save_path) == expected_hash:
-                return True
+        self.record_download(file_id, {**entry, **signature})
+        return True
+
+    def deep_verify(self):
+        """并发重新计算所有已下载文件的哈希，校验失败的从下载历史中删除以便重新下载"""
+        entries = list(self.history.items())
+        self.logger.info(f"开始深度校验 {len(entries)} 个已下载文件")
+
+        def verify(item):
+            file_id, entry = item
+            save_path = self.save_path / entry["date"] / entry["filename"]
+            try:
+                return file_id, self.calculate_file_hash(save_path) == entry.get('hash')
+            except OSError:
+                return file_id, False
+
+        invalid = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for file_id, ok in tqdm(executor.map(verify, entries), total=len(entries), desc="深度校验"):
+                if not ok:
+                    invalid.append(file_id)
+
+        with self.history_lock:
+            for file_id in invalid:
+                del self.history[file_id]
+        self.catalog.delete_history(invalid)
+        self.logger.info(f"深度校验完成: {len(entries) - len(invalid)} 个文件正常，{len(invalid)} 个文件缺失或损坏，将重新下载")
+
+    def parse_dlink(self, r_json):
+        """从下载接口的响应中取出下载链接"""
+        if "error_code" in r_json:
+            error_code = r_json["error_code"]
+            message = f"获取下载链接失败: {r_json.get('error_msg')} (error_code {error_code})"
+            # 认证失效时停止全部下载，文件不存在时不再重试，其余错误按退避时间重试
+            if error_code in AUTH_ERROR_CODES:
+                raise AuthError(message)
+            if error_code in NOT_FOUND_ERROR_CODES:
+                raise PermanentError(message)
+            raise Exception(message)
+
+        # 检查是否有下载链接
+        if 'dlink' not in r_json:
+            raise Exception(f"响应中缺少下载链接: {r_json}")
+        return r_json['dlink']
+
+    def resolve_dlink(self, fsid):
+        """请求下载接口获取下载链接，受下载链接并发上限控制"""
+        params = {
+            "clienttype": self.clienttype,
+            "bdstoken": self.bdstoken,
+            "fsid": fsid
+        }
+        with self.link_limiter:
+            try:
+                response = self.session.get(self.URL, params=params, headers=self.headers)
+                response.raise_for_status()
+            except Exception as e:
+                if is_throttle_error(e):
+                    self.link_limiter.record(throttled=True)
+                raise
+            self.link_limiter.record(ttfb=response.elapsed.total_seconds(), throttled=was_throttled(response))
+        return self.parse_dlink(response.json())
+
+    def link_duplicate(self, file_id, date, safe_filename, fsid, save_path, expected_size, expected_md5):
+        """服务器MD5和大小相同的照片已经下载过时，从本地副本链接过来，不再传输；成功时返回True"""
+        if not self.dedup.enabled or not expected_md5 or not expected_size:
+            return False
+        for dup_date, dup_filename, dup_fsid in self.catalog.find_duplicates(fsid, expected_md5, expected_size):
+            dup_name = Path(dup_filename).name
+            source = self.save_path / dup_date / dup_name
+            dup_id = f"{dup_date}_{dup_name}_{dup_fsid}"
+            if not self.validate_downloaded_file(dup_id, source):
+                continue
+            method = self.dedup.clone(source, save_path)
+            # 省下了文件下载请求，以及尚未发出的下载链接请求
+            self.dedup.record_linked(expected_size, 1 + self.links.skip(fsid))
+            self.finish_download(file_id, date, safe_filename, fsid, save_path, self.history[dup_id]["hash"])
+            self.logger.debug(f"{safe_filename} 与 {dup_name} 内容相同，已{method}，不再下载")
+            return True
         return False
 
+    def load_content_index(self):
+        """下载开始前从下载历史建立本地内容索引，用于下载后合并重复文件"""
+        if self.dedup.enabled:
+            with self.history_lock:
+                self.dedup.load(self.history, self.save_path)
+
+    def finish_download(self, file_id, date, safe_filename, fsid, save_path, file_hash):
+        """下载成功后记录下载历史（哈希值已在下载过程中算出）并清除失败记录"""
+        # 与已下载的文件内容相同时（如服务器没有提供MD5），合并为同一份，收回磁盘空间
+        if self.dedup.reclaim(save_path, file_hash, save_path.stat().st_size):
+            self.logger.debug(f"{safe_filename} 与已下载的文件内容相同，已合并")
+        self.record_download(file_id, {
+            "timestamp": time.time(),
+            "hash": file_hash,
+            "date": date,
+            "filename": safe_filename,
+            "fsid": fsid,
+            **self.stat_signature(save_path.stat())
+        })
+
+        # 删除该文件的失败记录
+        self.clear_failure(file_id)
+
+        self.log_success(f"成功下载并保存记录: {safe_filename}")
+
+    def log_success(self, message):
+        """按 log_success 配置输出单个文件成功的日志，默认每成功100个输出一条"""
+        if self.success_log == "all":
+            self.logger.info(message)
+        elif self.success_log == "sample":
+            count = next(self.success_count)
+            if count % self.success_log_every == 0:
+                self.logger.info(f"{message}（本次已成功 {count} 个）")
+
     def download_single_photo(self, date, filename, fsid):
-        """下载单张照片"""
+        """下载单张照片，成功返回True"""
+        return self.attempt_download(date, filename, fsid) is None
+
+    def attempt_download(self, date, filename, fsid):
+        """下载单张照片，成功返回None；失败时记录失败并返回异常，供重试调度器判断是否重试"""
         try:
             # 安全过滤文件名
             safe_filename = Path(filename).name
@@ -225,147 +780,170 @@ class photographDownload:
 
             # 检查是否已下载并验证完整性
             if self.validate_downloaded_file(file_id, save_path):
-                self.logger.info(f"文件已下载且验证通过: {safe_filename}")
-                return True
+                self.logger.debug(f"文件已下载且验证通过: {safe_filename}")
+                return None
 
             # 创建保存目录
-            save_path.parent.mkdir(parents=True, exist_ok=True)
-
-            # 获取下载链接
-            params = {
-                "clienttype": self.clienttype,
-                "bdstoken": self.bdstoken,
-                "fsid": fsid
-            }
-            response = self.session.get(self.URL, params=params, headers=self.headers)
-            response.raise_for_status()
-
-            r_json = response.json()
-            if "error_code" in r_json:
-                raise Exception(f"获取下载链接失败: {r_json.get('error_msg')}")
-            
-            # 检查是否有下载链接
-            if 'dlink' not in r_json:
-                raise Exception(f"响应中缺少下载链接: {r_json}")
-
-            # 下载文件
-            if self.download_with_resume(r_json['dlink'], save_path):
-                # 计算文件哈希值并记录下载历史
-                file_hash = self.calculate_file_hash(save_path)
-                
-                with self.history_lock:
-                    self.history[file_id] = {
-                        "timestamp": time.time(),
-                        "hash": file_hash,
-                        "date": date,
-                        "filename": safe_filename,
-                        "fsid": fsid,
-                        "size": save_path.stat().st_size
-                    }
-
-                # 立即保存下载历史到文件
-                self.save_download_history()
-
-                # 删除失败记录文件中的该文件
-                with self.failed_lock:
-                    if file_id in self.failed_history:
-                        del self.failed_history[file_id]
-                self.save_failed_downloads()
-
-                self.logger.info(f"成功下载并保存记录: {safe_filename}")
-                return True
-            return False
+            self.directories.ensure(save_path.parent)
+
+            # 同样内容已经下载过时直接链接，不再传输
+            expected_size, expected_md5 = self.catalog.get_checksum(fsid)
+            if self.link_duplicate(file_id, date, safe_filename, fsid, save_path, expected_size, expected_md5):
+                return None
+
+            # 获取下载链接，通常已由预取阶段准备好或仍在缓存有效期内
+            dlink = self.links.get(fsid)
+
+            # 下载文件，并与服务器提供的大小和MD5比对
+            try:
+                file_hash = self.download_verified(dlink, save_path, expected_size, expected_md5, file_id)
+            except DlinkExpiredError:
+                # 链接过期或被拒绝，重新获取一次
+                self.logger.info(f"下载链接已失效，重新获取: {safe_filename}")
+                self.links.invalidate(fsid)
+                file_hash = self.download_verified(self.links.get(fsid), save_path, expected_size, expected_md5, file_id)
+            self.finish_download(file_id, date, safe_filename, fsid, save_path, file_hash)
+            return None
         except Exception as e:
             self.logger.error(f"处理文件 {filename} 失败: {str(e)}")
 
-            # 将文件记录到失败下载文件
-            with self.failed_lock:
-                if file_id not in self.failed_history:
-                    self.failed_history[file_id] = {
-                        "date": date,
-                        "filename": filename,
-                        "fsid": fsid,
-                        "error": str(e)
-                    }
-            self.save_failed_downloads()
+            # 记录失败次数、错误类型和下次可重试时间
+            self.record_failure(file_id, date, filename, fsid, e)
 
-            return False
+            return e
+        finally:
+            self.links.done()
+
+    def migrate_json_dir(self):
+        """元数据目录为空时，自动导入旧版 ./json/ 下的逐文件元数据"""
+        if self.catalog.count() > 0 or not self.json_path.exists():
+            return
+        imported, failed = self.catalog.import_json_dir(self.json_path)
+        if imported or failed:
+            self.logger.info(f"已从 {self.json_path} 导入 {imported} 条旧版元数据，失败 {failed} 条")
+
+    def is_pending(self, date, filename, fsid):
+        """判断照片是否需要下载：未下载、校验失败或上次下载失败"""
+        if not date:
+            raise ValueError("缺少拍摄日期 extra_info.date_time")
+        file_id = f"{date}_{Path(filename).name}_{fsid}"
+        if file_id in self.failed_history:
+            return True
+        return not self.validate_downloaded_file(file_id, self.save_path / date / Path(filename).name)
+
+    def filter_pending(self, items):
+        """检查一批照片，返回其中需要下载的"""
+        pending = []
+        for date, filename, fsid in items:
+            try:
+                if self.is_pending(date, filename, fsid):
+                    pending.append((date, filename, fsid))
+            except Exception as e:
+                self.logger.error(f"处理文件 {filename} 元数据失败: {str(e)}")
+        return pending
+
+    def ordered_items(self):
+        """按下载顺序策略遍历目录中的照片，只使用元数据中的大小和日期，不访问本地文件"""
+        if self.schedule_policy == "interleave":
+            return interleave_by_size(self.catalog.iter_items(with_size=True))
+        return self.catalog.iter_items(self.schedule_policy)
+
+    def scan_pending(self):
+        """多线程并行检查目录中的照片，按下载顺序边检查边产出需要下载的文件"""
+        items = self.ordered_items()
+        batches = deque()
+        scanned = found = 0
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.scan_workers, thread_name_prefix="Scan") as executor:
+            while True:
+                # 最多同时检查 scan_workers * 2 批，既让线程保持忙碌，又不会一次读入全部结果
+                while len(batches) < self.scan_workers * 2:
+                    batch = list(itertools.islice(items, self.scan_batch_size))
+                    if not batch:
+                        break
+                    batches.append((len(batch), executor.submit(self.filter_pending, batch)))
+                if not batches:
+                    break
+                count, future = batches.popleft()
+                for item in future.result():
+                    found += 1
+                    yield item
+                scanned += count
+                self.progress.update_scan(scanned, time.monotonic() - start)
+
+        elapsed = time.monotonic() - start
+        self.progress.update_scan(scanned, elapsed, finished=True)
+        self.logger.info(
+            f"扫描完成: 检查 {scanned} 个文件，用时 {elapsed:.1f} 秒（{scanned / max(elapsed, 1e-6):.0f} 个/秒），"
+            f"待下载 {found} 个"
+        )
+
+    def download_pending(self, pending_files, handle=None, desc="下载进度", prefetch=True):
+        """用重试调度器下载待下载文件，pending_files 可以是边扫描边产出的迭代器；
+        失败的文件按各自的退避时间重新排队，下载线程始终保持忙碌，不必等待整轮结束。
+        handle 为处理单个文件的函数，默认直接下载；文件未经检查时应关闭 prefetch，以免为已下载的文件获取链接"""
+        scheduler = RetryScheduler(
+            handle or (lambda item: self.attempt_download(*item)), self.max_workers, self.logger,
+            max_attempts=self.max_attempts, base_delay=self.retry_base_delay, max_delay=self.retry_max_delay,
+        )
+        scheduler.on_finished = lambda item, success: self.progress.file_done(success)
+        scheduler.retry_state = self.retry_state
+        total = len(pending_files) if isinstance(pending_files, list) else None
+
+        def submit():
+            count = 0
+            for item in pending_files:
+                # 按提交顺序在后台提前获取下载链接，传输线程不必等待接口请求
+                if prefetch:
+                    self.links.add(item[2])
+                count += 1
+                yield item
+            # 扫描结束后总数才确定
+            self.progress.total = count
+
+        self.load_content_index()
+        self.progress.begin(total, desc)
+        if prefetch:
+            self.links.prefetch()
+        try:
+            failed_files = scheduler.run(submit())
+        finally:
+            self.progress.end()
+            self.links.shutdown()
+
+        if scheduler.retries:
+            self.logger.info(f"本次运行共重新排队 {scheduler.retries} 次")
+        if scheduler.gave_up:
+            self.logger.warning(f"以下 {len(scheduler.gave_up)} 个文件无法下载，已放弃重试：")
+            for _, filename, _ in scheduler.gave_up:
+                self.logger.warning(f"- {filename}")
+        if scheduler.failed:
+            self.logger.warning(f"以下文件在最大尝试次数 ({self.max_attempts}) 后仍然下载失败：")
+            for _, filename, _ in scheduler.failed:
+                self.logger.warning(f"- {filename}")
+        for _, filename, _ in failed_files:
+            self.failed_photos.add(filename)
 
     def download_photos(self):
         """并发下载所有照片"""
         try:
-            files = list(self.json_path.glob("*.json"))
-            total_files = len(files)
+            self.migrate_json_dir()
+            total_files = self.catalog.count()
 
             if total_files == 0:
                 self.logger.warning("没有找到要下载的文件")
                 return
 
             self.logger.info(f"总文件数: {total_files}")
-            self.logger.info("正在检查需要下载的文件")
-            # 优先下载失败文件
-            pending_files = []
-            for file in files:
-                try:
-                    with open(file, 'r', encoding="utf-8") as f:
-                        json_data = json.load(f)
-
-                    date = json_data["extra_info"]["date_time"][:10].replace(':', '-')
-                    filename = json_data["path"][12:]
-                    fsid = json_data["fsid"]
-                    file_id = f"{date}_{Path(filename).name}_{fsid}"
-
-                    # 如果文件未下载或已经失败，加入待下载列表
-                    if file_id in self.failed_history:
-                        pending_files.append((file, date, filename, fsid))
-                    elif not self.validate_downloaded_file(file_id, self.save_path / date / Path(filename).name):
-                        pending_files.append((file, date, filename, fsid))
-                except Exception as e:
-                    self.logger.error(f"处理文件 {file.name} 元数据失败: {str(e)}")
-
-            self.logger.info(f"待下载文件数: {len(pending_files)}")
-
-            retries = 0
-            max_retries = 5
-
-            while retries < max_retries and pending_files:
-                failed_files = []
-                self.logger.info(f"第 {retries + 1} 次尝试下载，待处理文件: {len(pending_files)}")
-
-                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-                    # 创建future到file的映射
-                    future_to_file = {
-                        executor.submit(self.download_single_photo, date, filename, fsid): (file_tuple, date, filename, fsid)
-                        for file_tuple, date, filename, fsid in pending_files
-                    }
-                    
-                    with tqdm(total=len(future_to_file), desc=f"重试 {retries + 1} 进度") as pbar:
-                        for future in as_completed(future_to_file):
-                            file_tuple, date, filename, fsid = future_to_file[future]
-                            try:
-                                if not future.result():
-                                    failed_files.append((file_tuple, date, filename, fsid))
-                            except Exception as e:
-                                self.logger.error(f"文件 {filename} 下载失败: {str(e)}")
-                                failed_files.append((file_tuple, date, filename, fsid))
-                            finally:
-                                pbar.update(1)
-
-                pending_files = failed_files
-                retries += 1
-
-            if pending_files:
-                self.logger.warning(f"以下文件在最大重试次数 ({max_retries}) 后仍然下载失败：")
-                for _, _, filename, _ in pending_files:
-                    self.logger.warning(f"- {filename}")
-                    self.failed_photos.add(filename)
+            self.logger.info(f"下载顺序: {self.schedule_policy}")
+            self.logger.info("开始检查需要下载的文件，检查的同时开始下载")
+            self.download_pending(self.scan_pending())
         finally:
             self.save_download_history()
-            self.save_failed_downloads()
 
     def print_summary(self):
         """打印下载总结"""
-        total_files = len(list(self.json_path.glob("*.json")))
+        total_files = self.catalog.count()
 
         successful = total_files - len(self.failed_photos)
 
@@ -373,33 +951,54 @@ class photographDownload:
         self.logger.info(f"总文件数: {total_files}")
         self.logger.info(f"成功下载: {successful}")
         self.logger.info(f"失败文件数: {len(self.failed_photos)}")
+        self.logger.info(self.transport_stats.summary())
+        self.logger.info(self.links.summary())
+        if self.dedup.enabled:
+            self.logger.info(self.dedup.summary())
+        self.logger.info(f"最终并发上限: 下载链接 {self.link_limiter.limit}，文件传输 {self.transfer_limiter.limit}")
 
         if self.failed_photos:
             self.logger.info("\n失败的文件:")
             for filename in self.failed_photos:
                 self.logger.info(f"- {filename}")
 
-    def start(self):
-        """启动下载流程"""
+    def start(self, deep_verify=False, policy=None):
+        """启动下载流程，policy 不为空时覆盖 settings.json 中的 schedule_policy"""
         try:
             self.logger.info("开始下载流程")
             self.check_auth()
+            if policy:
+                self.configure_policy(policy)
+            if deep_verify:
+                self.deep_verify()
             self.download_photos()
             self.print_summary()
         except KeyboardInterrupt:
             self.logger.warning("\n下载被用户中断")
             self.save_download_history()
-            self.save_failed_downloads()
             self.print_summary()
             sys.exit(0)
         except Exception as e:
             self.logger.error(f"下载过程发生错误: {str(e)}")
             self.save_download_history()
-            self.save_failed_downloads()
             self.print_summary()
             sys.exit(1)
 
 
 if __name__ == "__main__":
-    baidu_photo = photographDownload()
-    baidu_photo.start()
+    parser = argparse.ArgumentParser(description="下载一刻相册照片")
+    parser.add_argument("--deep-verify", action="store_true",
+                        help="重新计算所有已下载文件的哈希（默认只比对文件大小、修改时间和inode）")
+    parser.add_argument("--engine", choices=["threads", "asyncio"], default="threads",
+                        help="下载引擎: threads=线程池(默认)，asyncio=异步引擎(需要安装 aiohttp)")
+    parser.add_argument("--policy", choices=SCHEDULE_POLICIES, default=None,
+                        help="下载顺序: newest=新照片优先(默认)，smallest=小文件优先，largest=大文件优先，"
+                             "interleave=大小文件按比例交错；默认使用 settings.json 中的 schedule_policy")
+    args = parser.parse_args()
+
+    if args.engine == "asyncio":
+        from photographAsyncDownload import photographAsyncDownload
+        baidu_photo = photographAsyncDownload()
+    else:
+        baidu_photo = photographDownload()
+    baidu_photo.start(deep_verify=args.deep_verify, policy=args.policy)
@@ -0,0 +1,201 @@
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+# 下载链接失效时 dlink 返回的状态码
+EXPIRED_STATUS = (403, 410)
+TIME_UNITS = {"": 1, "s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+class DlinkExpiredError(Exception):
+    """下载链接已失效，需要重新获取"""
+
+
+def is_link_expired(error):
+    """传输文件时的异常是否说明下载链接已失效"""
+    response = getattr(error, "response", None)
+    status = response.status_code if response is not None else getattr(error, "status", None)
+    return status in EXPIRED_STATUS
+
+
+def link_expiry(dlink, resolved_at):
+    """从 dlink 的 expires 参数读取过期时间（如 expires=8h 或时间戳），没有时返回 None"""
+    expires = parse_qs(urlparse(dlink).query).get("expires", [""])[0]
+    match = re.fullmatch(r"(\d+)([smhd]?)", expires)
+    if not match:
+        return None
+    value = int(match.group(1))
+    if value > 1e9:  # 绝对时间戳
+        return float(value)
+    return resolved_at + value * TIME_UNITS[match.group(2)]
+
+
+# 获取下载链接的独立阶段：按下载顺序在后台提前获取 dlink，领先传输线程一段距离；
+# 获取到的链接连同过期时间保存在 photos.db 中，过期或返回403时才重新获取
+class LinkResolver:
+    def __init__(self, resolve, catalog, logger):
+        self.resolve = resolve  # fsid -> dlink，实际请求下载接口
+        self.catalog = catalog
+        self.logger = logger
+        self.ttl = 3600  # dlink 中没有 expires 参数时假定的有效期(秒)
+        self.learned_ttl = None  # 观察到的实际有效期（链接提前失效时记录）
+        self.expiry_margin = 300  # 距离过期不足该秒数的链接不再使用，避免传输中途过期
+        self.lookahead = 256  # 预取最多领先传输多少个文件
+        self.workers = 8  # 预取线程数，实际并发受下载链接并发上限控制
+        self.cache = {}  # fsid -> (dlink, resolved_at, expires_at)
+        self.futures = {}  # fsid -> 正在预取的 Future
+        self.fetching = set()  # 传输线程正在直接获取链接的 fsid，预取时跳过
+        self.condition = threading.Condition()
+        self.fed = 0  # 本轮已交给预取的文件数
+        self.consumed = 0  # 本轮已完成传输的文件数
+        self.generation = 0  # 每轮预取的编号，新一轮开始或结束时让旧的预取线程退出
+        self.pending = None  # 本轮等待预取的 fsid 队列
+        self.executor = None
+        self.hits = 0  # 使用缓存链接的次数
+        self.resolved = 0  # 请求下载接口的次数
+        self.expired = 0  # 链接失效后重新获取的次数
+
+    def configure(self, config, workers):
+        """按配置设置有效期和预取距离，并读取磁盘上仍然有效的链接"""
+        self.ttl = float(config.get("dlink_ttl", self.ttl))
+        self.lookahead = int(config.get("dlink_prefetch", self.lookahead))
+        self.workers = workers
+        self.learned_ttl = self.catalog.get_meta("dlink_ttl")
+        now = time.time()
+        self.catalog.purge_dlinks(now + self.expiry_margin)
+        self.cache = {
+            fsid: (dlink, resolved_at, self.expires_at(dlink, resolved_at))
+            for fsid, dlink, resolved_at in self.catalog.load_dlinks()
+        }
+
+    def expires_at(self, dlink, resolved_at):
+        """链接的过期时间：优先使用 dlink 自带的过期时间，观察到的有效期更短时以观察为准"""
+        candidates = [link_expiry(dlink, resolved_at) or resolved_at + self.ttl]
+        if self.learned_ttl:
+            candidates.append(resolved_at + self.learned_ttl)
+        return min(candidates)
+
+    def cached(self, fsid):
+        """缓存中仍然有效的链接，没有时返回 None"""
+        entry = self.cache.get(fsid)
+        if entry and entry[2] - self.expiry_margin > time.time():
+            return entry[0]
+        return None
+
+    def store(self, fsid, dlink, resolved_at=None):
+        """保存新获取的链接"""
+        resolved_at = resolved_at or time.time()
+        expires_at = self.expires_at(dlink, resolved_at)
+        self.cache[fsid] = (dlink, resolved_at, expires_at)
+        self.catalog.save_dlink(fsid, dlink, resolved_at, expires_at)
+        return dlink
+
+    def fetch(self, fsid):
+        """请求下载接口获取链接并缓存"""
+        resolved_at = time.time()
+        dlink = self.resolve(fsid)
+        with self.condition:
+            self.resolved += 1
+        return self.store(fsid, dlink, resolved_at)
+
+    def get(self, fsid):
+        """返回可用的下载链接：优先使用缓存，其次等待预取结果，都没有时立即获取"""
+        dlink = self.cached(fsid)
+        with self.condition:
+            future = self.futures.pop(fsid, None)
+            if not future and not dlink:
+                self.fetching.add(fsid)
+        if future:
+            return future.result()
+        if dlink:
+            with self.condition:
+                self.hits += 1
+            return dlink
+        try:
+            return self.fetch(fsid)
+        finally:
+            # 获取成功后链接已在缓存中，预取同样会跳过
+            with self.condition:
+                self.fetching.discard(fsid)
+
+    def invalidate(self, fsid):
+        """链接返回403等失效状态，删除缓存；比预期更早失效时记下实际有效期"""
+        entry = self.cache.pop(fsid, None)
+        self.catalog.delete_dlink(fsid)
+        self.expired += 1
+        if not entry:
+            return
+        dlink, resolved_at, expires_at = entry
+        age = time.time() - resolved_at
+        if age < expires_at - resolved_at - self.expiry_margin and age > self.expiry_margin:
+            # 留出余量，之后按观察到的有效期判断
+            self.learned_ttl = age
+            self.catalog.set_meta("dlink_ttl", age)
+            self.logger.info(f"下载链接在 {age / 60:.0f} 分钟后失效，之后按此有效期缓存")
+
+    def prefetch(self, fsids=()):
+        """开始新一轮预取：在后台按顺序提前获取下载链接，最多领先传输 lookahead 个文件；
+        之后提交的文件可以继续用 add 加入"""
+        with self.condition:
+            self.generation += 1
+            self.fed = 0
+            self.consumed = 0
+            generation = self.generation
+            if self.pending is not None:
+                self.pending.put(None)
+            self.pending = queue.SimpleQueue()
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="Resolver")
+        threading.Thread(target=self.feed, args=(self.pending, generation), name="LinkPrefetch", daemon=True).start()
+        for fsid in fsids:
+            self.add(fsid)
+
+    def add(self, fsid):
+        """把即将提交下载的文件加入本轮预取"""
+        if self.pending is not None:
+            self.pending.put(fsid)
+
+    def feed(self, pending, generation):
+        while True:
+            fsid = pending.get()
+            if fsid is None:
+                return
+            with self.condition:
+                while self.fed - self.consumed >= self.lookahead and generation == self.generation:
+                    self.condition.wait()
+                if generation != self.generation:
+                    return
+                self.fed += 1
+                if fsid in self.futures or fsid in self.fetching or self.cached(fsid):
+                    continue
+                self.futures[fsid] = self.executor.submit(self.fetch, fsid)
+
+    def skip(self, fsid):
+        """文件不需要传输时调用：取消尚未开始的预取，返回是否因此省下了一次接口请求"""
+        with self.condition:
+            future = self.futures.pop(fsid, None)
+        if future is not None:
+            return future.cancel()
+        return self.cached(fsid) is None
+
+    def done(self):
+        """传输线程处理完一个文件后调用，让预取继续向前"""
+        with self.condition:
+            self.consumed += 1
+            self.condition.notify_all()
+
+    def shutdown(self):
+        """一轮下载结束后丢弃未使用的预取结果"""
+        with self.condition:
+            self.generation += 1
+            self.futures.clear()
+            if self.pending is not None:
+                self.pending.put(None)
+                self.pending = None
+            self.condition.notify_all()
+
+    def summary(self):
+        return f"下载链接: 请求接口 {self.resolved} 次，使用缓存 {self.hits} 次，失效后重新获取 {self.expired} 次"
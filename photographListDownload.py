@@ -1,9 +1,15 @@
+import argparse
 import json
-import os
-from datetime import datetime
+import sys
+import time
+from datetime import datetime, timedelta
 
 import requests
 
+from photographCatalog import photographCatalog
+from photographScheduler import AUTH_ERROR_CODES, AuthError
+from photographSession import TransportStats, create_session
+
 
 # 获取文件信息
 class photographListDownload:
@@ -11,78 +17,296 @@ class photographListDownload:
         self.headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/111.0.0.0 Safari/537.36"
         }
-        self.path = "./json/"
+        self.URL = "https://photo.baidu.com/youai/file/v1/list"
+        self.catalog = None  # 照片元数据目录 photos.db，可由调用方传入共享
+        self.session = None  # HTTP 会话，可由调用方传入与下载共享
+        self.transport_stats = TransportStats()
+        self.on_page = None  # 每页保存后的回调，参数为 [(date, filename, fsid), ...]
         self.clienttype = None
         self.bdstoken = None
         self.need_thumbnail = None
         self.need_filter_hidden = None
         self.flag = True
         self.total_photos = 0  # 记录总共爬取的照片数
-        self.filter_date = None  # 过滤日期
-        self.date_mode = None  # 日期过滤模式: 'before' 或 'after'
+        self.start_date = None  # 日期范围起点(含)，格式与 date_time 一致: YYYY:MM:DD
+        self.end_date = None  # 日期范围终点(含)
+        self.date_order = None  # 列表按拍摄日期的排列方向: 'desc'、'asc'、'unordered' 或 None(尚未确定)
+        self.last_day = None  # 上一条记录的拍摄日期，用于判断排列方向
+        self.early_stopped = False  # 是否因越过日期范围提前停止
         self.skipped_photos = 0  # 跳过的照片数
+        self.incremental = False  # 增量同步: 遇到已知照片后停止翻页
+        self.incremental_overlap_pages = 1  # 增量同步时, 连续多少页已知照片后才停止（安全重叠窗口）
+        self.known_pages = 0  # 当前连续已知页数
+        self.last_newest_ctime = None  # 上次同步见过的最新照片时间戳
+        self.newest_ctime = None  # 本次同步见过的最新照片时间戳
+        self.pages = 0  # 本次请求的页数
+        self.failed = False  # 本次爬取是否因错误中断
+        self.max_retries = 5  # 单页请求失败后的最大重试次数
+        self.retry_backoff = 1  # 重试退避基数(秒)，每次翻倍
+
+    @staticmethod
+    def photo_day(photo):
+        """照片拍摄日期 YYYY:MM:DD，没有日期信息时返回 None"""
+        date_time = photo.get("extra_info", {}).get("date_time")
+        return date_time[:10] if date_time else None
+
+    def is_filtered(self, photo):
+        """按日期范围判断照片是否应跳过，直接比较 YYYY:MM:DD 字符串"""
+        day = self.photo_day(photo)
+        if not day:
+            return False
+        return bool((self.start_date and day < self.start_date) or (self.end_date and day > self.end_date))
+
+    def past_date_range(self, photo_list):
+        """列表按日期有序时，判断本页之后的照片是否都已超出日期范围"""
+        for day in filter(None, map(self.photo_day, photo_list)):
+            if self.last_day and day != self.last_day and self.date_order != "unordered":
+                order = "desc" if day < self.last_day else "asc"
+                if self.date_order is None:
+                    self.date_order = order
+                elif self.date_order != order:
+                    self.date_order = "unordered"
+                    print("列表未按拍摄日期排序，无法提前停止翻页")
+            self.last_day = day
+
+        if self.last_day is None:
+            return False
+        if self.date_order == "desc" and self.start_date:
+            return self.last_day < self.start_date
+        if self.date_order == "asc" and self.end_date:
+            return self.last_day > self.end_date
+        return False
 
-    def save_json(self, photo_list):
+    def report_early_stop(self, page_size):
+        """估算提前停止节省的页数（依据目录中已有的超出范围的照片数）"""
+        if self.date_order == "desc":
+            outside = self.catalog.count_by_date(before=self.start_date.replace(':', '-'))
+        else:
+            outside = self.catalog.count_by_date(after=self.end_date.replace(':', '-'))
+        if outside and page_size:
+            print(f"日期范围: 已越过范围边界，第 {self.pages} 页后停止翻页，约节省 {-(-outside // page_size)} 页请求")
+        else:
+            print(f"日期范围: 已越过范围边界，第 {self.pages} 页后停止翻页")
+
+    def is_known_page(self, photo_list):
+        """整页照片都已在目录中（或被过滤），且都不比上次同步见过的最新照片更新"""
+        known = self.catalog.known_fsids(photo["fsid"] for photo in photo_list)
+        for photo in photo_list:
+            if int(photo["fsid"]) not in known and not self.is_filtered(photo):
+                return False
+            ctime = photo.get("ctime")
+            if ctime and self.last_newest_ctime and ctime > self.last_newest_ctime:
+                return False
+        return True
+
+    def track_newest(self, photo_list):
+        """记录本次见过的最新照片时间戳"""
+        ctimes = [photo["ctime"] for photo in photo_list if photo.get("ctime")]
+        if ctimes:
+            self.newest_ctime = max(ctimes + ([self.newest_ctime] if self.newest_ctime else []))
+
+    def save_photos(self, photo_list):
+        rows = []
         for photo in photo_list:
             try:
-                # 日期过滤
-                if self.filter_date and "extra_info" in photo and "date_time" in photo["extra_info"]:
-                    photo_date_str = photo["extra_info"]["date_time"][:10]  # 获取日期部分 YYYY:MM:DD
-                    photo_date = datetime.strptime(photo_date_str.replace(':', '-'), '%Y-%m-%d')
-                    
-                    # 根据模式过滤
-                    if self.date_mode == 'before' and photo_date >= self.filter_date:
-                        self.skipped_photos += 1
-                        continue
-                    elif self.date_mode == 'after' and photo_date <= self.filter_date:
-                        self.skipped_photos += 1
-                        continue
-                
-                # 安全处理文件路径，path前12个字符是"/mnt/yike/fs"前缀
-                file_name = os.path.join(self.path, photo["path"][12:] + ".json")
-                with open(file_name, "w", encoding="utf-8") as f:
-                    json.dump(photo, f, ensure_ascii=False, indent=4)
-                self.total_photos += 1
+                if self.is_filtered(photo):
+                    self.skipped_photos += 1
+                    continue
+
+                rows.append(self.catalog.photo_to_row(photo))
             except Exception as e:
-                print(f"保存文件失败: {file_name}, 错误: {e}")
+                print(f"解析照片记录失败: {photo.get('path')}, 错误: {e}")
+
+        try:
+            self.total_photos += self.catalog.upsert_rows(rows)
+        except Exception as e:
+            print(f"保存元数据失败: {e}")
+            return
+
+        if self.on_page:
+            self.on_page([self.catalog.row_to_item(row) for row in rows])
+
+    def fetch_page(self, cursor):
+        """请求一页照片列表，网络错误、5xx/429或接口返回错误码时按指数退避重试；
+        认证失效或重试次数用尽时抛出异常，不能当作列表已经翻完"""
+        params = {
+            "clienttype": self.clienttype,
+            "bdstoken": self.bdstoken,
+            "need_thumbnail": self.need_thumbnail,
+            "need_filter_hidden": self.need_filter_hidden,
+        }
+        if cursor:
+            params["cursor"] = cursor
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.get(self.URL, params=params, headers=self.headers)
+                response.raise_for_status()
+                data = response.json()
+            except requests.RequestException as e:
+                status = e.response.status_code if e.response is not None else None
+                # 4xx（429除外）重试也不会成功，直接放弃
+                if (status and status < 500 and status != 429) or attempt >= self.max_retries:
+                    raise
+                error = e
+            else:
+                # HTTP 200 也可能是接口错误（如服务器繁忙、Cookie 过期），此时响应中没有 list
+                error_code = data.get("errno") or data.get("error_code")
+                if not error_code:
+                    return data
+                message = data.get("errmsg") or data.get("error_msg") or ""
+                error = Exception(f"列表接口返回错误 errno {error_code} {message}".rstrip())
+                if error_code in AUTH_ERROR_CODES:
+                    raise AuthError(f"认证信息无效或已过期: {error}")
+                if attempt >= self.max_retries:
+                    raise error
+            delay = min(self.retry_backoff * 2 ** attempt, 60)
+            print(f"第 {self.pages + 1} 页请求失败: {error}，{delay} 秒后重试 ({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+    def save_checkpoint(self, cursor):
+        """每页完成后保存游标，中断后可用 --resume 继续"""
+        self.catalog.set_meta("crawl_checkpoint", {
+            "cursor": cursor,
+            "pages": self.pages,
+            "total_photos": self.total_photos,
+            "skipped_photos": self.skipped_photos,
+            "newest_ctime": self.newest_ctime,
+            "updated_at": time.time(),
+        })
 
-    def crawler(self, URL):
+    def crawler(self, cursor):
         try:
-            response = requests.get(URL, headers=self.headers, timeout=30)
-            response.raise_for_status()
-            data = response.json()
+            data = self.fetch_page(cursor)
 
             photo_list = data.get("list", [])
             if not photo_list:  # 爬取完毕
                 self.flag = False
                 return None
             
+            self.pages += 1
             print(f"获取到 {len(photo_list)} 张照片，累计: {self.total_photos + len(photo_list)}")
-            self.save_json(photo_list)
+            known_page = self.incremental and self.is_known_page(photo_list)
+            self.save_photos(photo_list)
+            self.track_newest(photo_list)
+
+            if (self.start_date or self.end_date) and self.past_date_range(photo_list):
+                self.report_early_stop(len(photo_list))
+                self.early_stopped = True
+                self.flag = False
+                return None
+
+            if self.incremental:
+                self.known_pages = self.known_pages + 1 if known_page else 0
+                if self.known_pages > self.incremental_overlap_pages:
+                    print(f"增量同步: 已连续 {self.known_pages} 页都是已知照片，停止翻页")
+                    self.flag = False
+                    return None
 
             cursor = data.get("cursor")
+            self.save_checkpoint(cursor)
             return cursor
+        except AuthError as e:
+            print(f"认证失败: {e}，请在 settings.json 中更新 Cookie 和 bdstoken 后重试")
+            self.flag = False
+            self.failed = True
+            return None
         except requests.RequestException as e:
             print(f"网络请求失败: {e}")
             self.flag = False
+            self.failed = True
             return None
         except json.JSONDecodeError as e:
             print(f"JSON解析失败: {e}")
             self.flag = False
+            self.failed = True
             return None
         except Exception as e:
             print(f"未知错误: {e}")
             self.flag = False
+            self.failed = True
             return None
 
-    def func(self):
-        URL = f"https://photo.baidu.com/youai/file/v1/list?clienttype={self.clienttype}&bdstoken={self.bdstoken}&need_thumbnail={self.need_thumbnail}&need_filter_hidden={self.need_filter_hidden}"
-        cursor = self.crawler(URL)
+    def func(self, cursor=None):
+        cursor = self.crawler(cursor)
         while self.flag and cursor:
-            URL = f"https://photo.baidu.com/youai/file/v1/list?clienttype={self.clienttype}&bdstoken={self.bdstoken}&cursor={cursor}&need_thumbnail={self.need_thumbnail}&need_filter_hidden={self.need_filter_hidden}"
-            cursor = self.crawler(URL)
+            cursor = self.crawler(cursor)
+
+    def load_checkpoint(self, resume):
+        """读取上次中断时保存的游标，返回继续爬取的起点"""
+        checkpoint = self.catalog.get_meta("crawl_checkpoint")
+        if not resume:
+            if checkpoint:
+                print(f"提示: 上次爬取在第 {checkpoint['pages']} 页中断，可使用 --resume 从中断处继续")
+            return None
+        if not checkpoint or not checkpoint.get("cursor"):
+            print("未找到可继续的爬取进度，从第一页开始")
+            return None
+
+        self.pages = checkpoint["pages"]
+        self.total_photos = checkpoint["total_photos"]
+        self.skipped_photos = checkpoint.get("skipped_photos", 0)
+        self.newest_ctime = checkpoint.get("newest_ctime")
+        print(f"从第 {self.pages + 1} 页继续爬取（已获取 {self.total_photos} 张）")
+        return checkpoint["cursor"]
 
-    def start(self):
+    def load_date_range(self, json_data):
+        """读取日期范围配置：start_date/end_date，兼容旧的 filter_date + date_mode"""
+        start = None
+        end = None
+        try:
+            if json_data.get("start_date"):
+                start = datetime.strptime(json_data["start_date"], '%Y-%m-%d')
+            if json_data.get("end_date"):
+                end = datetime.strptime(json_data["end_date"], '%Y-%m-%d')
+        except ValueError:
+            print("警告: start_date/end_date 格式不正确，应为 YYYY-MM-DD，已忽略日期范围")
+            start = end = None
+
+        # 读取旧版日期过滤配置（可选），before/after 都不包括当天
+        if json_data.get("filter_date"):
+            try:
+                filter_date = datetime.strptime(json_data["filter_date"], '%Y-%m-%d')
+                if json_data.get("date_mode", "before") == "before":  # 默认为before
+                    day = filter_date - timedelta(days=1)
+                    end = min(end, day) if end else day
+                else:
+                    day = filter_date + timedelta(days=1)
+                    start = max(start, day) if start else day
+            except ValueError:
+                print("警告: filter_date 格式不正确，应为 YYYY-MM-DD，已忽略日期过滤")
+
+        self.start_date = start.strftime('%Y:%m:%d') if start else None
+        self.end_date = end.strftime('%Y:%m:%d') if end else None
+        if self.start_date or self.end_date:
+            print(f"日期过滤已启用: 只获取 {start.strftime('%Y-%m-%d') if start else '最早'} 至 "
+                  f"{end.strftime('%Y-%m-%d') if end else '最新'} 的照片")
+
+    def load_sync_state(self):
+        """读取上次同步状态，决定本次是否可以增量同步"""
+        if not self.incremental:
+            return
+        state = self.catalog.get_meta("sync_state")
+        if not state or self.catalog.count() == 0:
+            print("未找到上次完整同步的记录，本次执行全量同步")
+            self.incremental = False
+            return
+        self.last_newest_ctime = state.get("newest_ctime")
+        print(f"增量同步已启用: 连续 {self.incremental_overlap_pages + 1} 页均为已知照片时停止翻页")
+
+    def save_sync_state(self):
+        """爬取正常结束后记录同步状态，供下次增量同步使用"""
+        if self.failed:
+            return
+        self.catalog.delete_meta("crawl_checkpoint")
+        if self.early_stopped:  # 没有翻完整个列表，不能作为下次增量同步的基准
+            return
+        newest = max(filter(None, [self.newest_ctime, self.last_newest_ctime]), default=None)
+        self.catalog.set_meta("sync_state", {"newest_ctime": newest, "synced_at": time.time()})
+
+    def start(self, incremental=None, resume=False):
+        """获取照片元数据，全部获取完成时返回 True；中途失败或配置错误时返回 False"""
+        owns_catalog = self.catalog is None
         try:
             with open("settings.json", 'r', encoding='utf-8') as f:
                 json_data = json.load(f)
@@ -93,23 +317,33 @@ class photographListDownload:
             self.need_filter_hidden = json_data["need_filter_hidden"]
             self.headers["Cookie"] = json_data["Cookie"]
             
-            # 读取日期过滤配置（可选）
-            if "filter_date" in json_data and json_data["filter_date"]:
-                try:
-                    self.filter_date = datetime.strptime(json_data["filter_date"], '%Y-%m-%d')
-                    self.date_mode = json_data.get("date_mode", "before")  # 默认为before
-                    print(f"日期过滤已启用: 只获取 {self.filter_date.strftime('%Y-%m-%d')} {'之前' if self.date_mode == 'before' else '之后'} 的照片")
-                except ValueError:
-                    print("警告: filter_date 格式不正确，应为 YYYY-MM-DD，已忽略日期过滤")
+            self.load_date_range(json_data)
 
-            os.makedirs(self.path, exist_ok=True)
+            self.incremental = json_data.get("incremental", False) if incremental is None else incremental
+            self.incremental_overlap_pages = int(json_data.get("incremental_overlap_pages", 1))
+            self.max_retries = int(json_data.get("list_max_retries", self.max_retries))
+            self.retry_backoff = float(json_data.get("list_retry_backoff", self.retry_backoff))
+            if self.session is None:
+                self.session = create_session(json_data, self.transport_stats)
+
+            if owns_catalog:
+                self.catalog = photographCatalog()
+            self.load_sync_state()
+            cursor = self.load_checkpoint(resume)
 
             print("开始获取照片元数据...")
-            self.func()
+            self.func(cursor)
+            self.save_sync_state()
+            print(f"共请求 {self.pages} 页")
+            print(self.transport_stats.summary())
+            if self.failed:
+                print(f"\n✗ 元数据获取未完成，已获取 {self.total_photos} 张照片的信息，可使用 --resume 从中断处继续")
+                return False
             if self.skipped_photos > 0:
                 print(f"\n✓ 元数据获取完成！共获取 {self.total_photos} 张照片的信息，跳过 {self.skipped_photos} 张")
             else:
                 print(f"\n✓ 元数据获取完成！共获取 {self.total_photos} 张照片的信息")
+            return True
         except FileNotFoundError:
             print("错误: settings.json 文件不存在")
         except json.JSONDecodeError as e:
@@ -118,6 +352,21 @@ class photographListDownload:
             print(f"错误: settings.json 缺少必要字段 - {e}")
         except Exception as e:
             print(f"错误: {e}")
+        finally:
+            if owns_catalog and self.catalog:
+                self.catalog.close()
+                self.catalog = None
+        return False
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="获取一刻相册照片元数据")
+    sync_mode = parser.add_mutually_exclusive_group()
+    sync_mode.add_argument("--incremental", dest="incremental", action="store_true", default=None,
+                           help="增量同步，遇到已知照片后停止翻页")
+    sync_mode.add_argument("--full", dest="incremental", action="store_false",
+                           help="全量同步，忽略 settings.json 中的 incremental")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的游标处继续爬取")
+    args = parser.parse_args()
+
     find_photo_list = photographListDownload()
-    find_photo_list.start()
\ No newline at end of file
+    if not find_photo_list.start(incremental=args.incremental, resume=args.resume):
+        sys.exit(1)
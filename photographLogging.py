@@ -0,0 +1,35 @@
+import atexit
+import logging
+import logging.handlers
+import queue
+
+LOG_FORMAT = '%(asctime)s - [%(threadName)s] - %(levelname)s - %(message)s'
+
+_listener = None
+
+
+def setup_logging(log_file="download.log", max_bytes=10 * 1024 * 1024, backup_count=5, level=logging.INFO):
+    """配置基于队列的日志：下载线程只把日志记录放入队列，由单独的线程格式化并写入文件和终端；
+    download.log 超过 max_bytes 后轮转，保留 backup_count 个旧文件。重复调用时直接返回"""
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+    )
+    stream_handler = logging.StreamHandler()
+    for handler in (file_handler, stream_handler):
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # 退出前把队列中剩余的日志写完
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,125 @@
+import argparse
+import sys
+import threading
+from queue import Queue
+
+from photographDownload import photographDownload
+from photographListDownload import photographListDownload
+from photographScheduler import SCHEDULE_POLICIES
+
+
+# 边获取元数据边下载：每获取一页就通过有界队列交给下载器的重试调度器
+class photographPipeline:
+    def __init__(self):
+        self.downloader = photographDownload()
+        self.logger = self.downloader.logger
+        self.lister = photographListDownload()
+        self.lister.catalog = self.downloader.catalog  # 共享同一个元数据目录
+        self.lister.on_page = self.on_page
+        self.queue_size = 1000  # 元数据到下载之间的队列长度
+        self.queue = None
+        self.queued = set()  # 已交给调度器的 fsid
+        self.listed = False  # 元数据是否全部获取成功
+
+    def on_page(self, items):
+        """获取元数据线程的回调，队列满时阻塞，让翻页速度跟上下载速度"""
+        for item in items:
+            self.queue.put(item)
+
+    def list_worker(self, incremental, resume):
+        """获取元数据线程"""
+        try:
+            self.listed = self.lister.start(incremental=incremental, resume=resume)
+        finally:
+            self.queue.put(None)  # 结束标记
+
+    def download_item(self, item):
+        """检查并下载单张照片，成功返回None，失败返回异常，由调度器决定是否重试"""
+        date, filename, fsid = item
+        try:
+            if not self.downloader.is_pending(date, filename, fsid):
+                return None
+        except Exception as e:
+            self.logger.error(f"处理文件 {filename} 失败: {str(e)}")
+            return e
+        return self.downloader.attempt_download(date, filename, fsid)
+
+    def items(self):
+        """按获取顺序产出待检查的照片，已提交过的照片不重复提交"""
+        while True:
+            item = self.queue.get()
+            if item is None:
+                break
+            if item[2] not in self.queued:
+                self.queued.add(item[2])
+                yield item
+
+        # 目录中其余尚未下载的照片（如增量同步没有翻到的旧照片、上次失败的照片），按下载顺序策略排列
+        self.logger.info("元数据获取结束，检查目录中其余未下载的照片")
+        for item in self.downloader.ordered_items():
+            if item[2] not in self.queued:
+                self.queued.add(item[2])
+                yield item
+
+    def run(self, incremental=None, resume=False):
+        """并行执行获取元数据和下载"""
+        config = self.downloader.load_config()
+        self.queue_size = int(config.get("pipeline_queue_size", self.queue_size))
+        self.queue = Queue(maxsize=self.queue_size)
+
+        # 共享下载器的连接池，两个阶段复用同一批长连接
+        self.lister.session = self.downloader.session
+        self.lister.transport_stats = self.downloader.transport_stats
+
+        self.downloader.migrate_json_dir()
+        lister_thread = threading.Thread(
+            target=self.list_worker, args=(incremental, resume), name="Lister", daemon=True
+        )
+        lister_thread.start()
+
+        # 失败的照片在同一个调度器中按退避时间重试，不再另开重试轮次
+        self.downloader.download_pending(self.items(), handle=self.download_item,
+                                         desc="边获取边下载", prefetch=False)
+        lister_thread.join()
+        self.logger.info(f"下载完成，共处理 {len(self.queued)} 张照片，失败 {len(self.downloader.failed_photos)} 张")
+
+    def start(self, incremental=None, resume=False, policy=None):
+        """启动边获取边下载流程；获取中的照片按翻页顺序下载，policy 决定之后目录中其余照片的顺序。
+        元数据没有全部获取成功时返回 False"""
+        try:
+            self.logger.info("开始边获取元数据边下载")
+            self.downloader.check_auth()
+            if policy:
+                self.downloader.configure_policy(policy)
+            self.run(incremental=incremental, resume=resume)
+            self.downloader.print_summary()
+            if not self.listed:
+                self.logger.error("元数据获取未完成，只下载了已获取到的照片，可使用 --resume 从中断处继续")
+            return self.listed
+        except KeyboardInterrupt:
+            self.logger.warning("\n下载被用户中断")
+            self.downloader.print_summary()
+            sys.exit(0)
+        except Exception as e:
+            self.logger.error(f"下载过程发生错误: {str(e)}")
+            self.downloader.print_summary()
+            sys.exit(1)
+        finally:
+            self.downloader.save_download_history()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="边获取一刻相册元数据边下载照片")
+    sync_mode = parser.add_mutually_exclusive_group()
+    sync_mode.add_argument("--incremental", dest="incremental", action="store_true", default=None,
+                           help="增量同步，遇到已知照片后停止翻页")
+    sync_mode.add_argument("--full", dest="incremental", action="store_false",
+                           help="全量同步，忽略 settings.json 中的 incremental")
+    parser.add_argument("--resume", action="store_true", help="从上次中断的游标处继续爬取")
+    parser.add_argument("--policy", choices=SCHEDULE_POLICIES, default=None,
+                        help="元数据获取结束后，目录中其余照片的下载顺序（默认使用 settings.json 中的 schedule_policy）")
+    args = parser.parse_args()
+
+    pipeline = photographPipeline()
+    if not pipeline.start(incremental=args.incremental, resume=args.resume, policy=args.policy):
+        sys.exit(1)
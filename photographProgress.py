@@ -0,0 +1,141 @@
+import json
+import threading
+import time
+
+from tqdm import tqdm
+
+
+def format_bytes(size):
+    """把字节数格式化为便于阅读的字符串"""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+
+# 汇总的下载进度：所有下载线程共用一个进度条，按固定间隔刷新；
+# 各线程只累加自己的计数器，不需要加锁，刷新线程读取时再求和
+class ProgressReporter:
+    def __init__(self, logger, inflight=None):
+        self.logger = logger
+        self.inflight = inflight  # 返回当前进行中传输数的函数
+        self.interval = 0.5  # 进度条刷新间隔(秒)
+        self.log_interval = 10  # 输出机器可读进度行的间隔(秒)，0表示不输出
+        self.on_update = None  # 每次刷新时的回调，参数为 (已完成数, 总数)
+        self.local = threading.local()
+        self.counters = []  # 每个线程一个 [字节数, 完成数, 失败数]
+        self.counters_lock = threading.Lock()  # 只在线程第一次上报时注册计数器用
+        self.desc = ""
+        self.total = None
+        self.started = 0.0
+        self.scan = None  # 边扫描边下载时的扫描进度 (已检查数, 耗时秒数, 是否完成)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def counter(self):
+        """当前线程自己的计数器"""
+        counter = getattr(self.local, "counter", None)
+        if counter is None:
+            counter = self.local.counter = [0, 0, 0]
+            with self.counters_lock:
+                self.counters.append(counter)
+        return counter
+
+    def add_bytes(self, size):
+        """下载线程每写入一块数据调用一次"""
+        self.counter()[0] += size
+
+    def file_done(self, success=True):
+        """处理完一个文件（成功、跳过或失败）后调用"""
+        counter = self.counter()
+        counter[1] += 1
+        if not success:
+            counter[2] += 1
+
+    def snapshot(self):
+        """(字节数, 完成数, 失败数)"""
+        with self.counters_lock:
+            counters = list(self.counters)
+        return tuple(sum(counter[i] for counter in counters) for i in range(3))
+
+    def begin(self, total=None, desc="下载进度"):
+        """开始一轮下载，total 为 None 时表示总数未知（如边获取边下载）"""
+        self.end()
+        with self.counters_lock:
+            for counter in self.counters:
+                counter[:] = [0, 0, 0]
+        self.total = total
+        self.desc = desc
+        self.scan = None
+        self.started = time.monotonic()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="Progress", daemon=True)
+        self.thread.start()
+
+    def end(self):
+        """结束本轮，输出最后一次进度"""
+        if self.thread is None:
+            return
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def update_scan(self, scanned, elapsed, finished=False):
+        """记录待下载文件的扫描进度，扫描速度与下载速度分开统计"""
+        self.scan = (scanned, elapsed, finished)
+
+    def stats(self):
+        """当前进度的统计数据"""
+        size, done, failed = self.snapshot()
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        files_per_s = done / elapsed
+        remaining = self.total - done if self.total is not None else None
+        scan = {}
+        if self.scan:
+            scanned, scan_elapsed, finished = self.scan
+            scan = {
+                "scanned": scanned,
+                "scan_per_s": round(scanned / max(scan_elapsed, 1e-6)),
+                "scan_finished": finished,
+            }
+        return {
+            "desc": self.desc,
+            "files_done": done,
+            "files_total": self.total,
+            "failed": failed,
+            "inflight": self.inflight() if self.inflight else None,
+            "bytes": size,
+            "bytes_per_s": round(size / elapsed),
+            "files_per_s": round(files_per_s, 2),
+            "eta_s": round(remaining / files_per_s) if remaining is not None and files_per_s else None,
+            "error_rate": round(failed / done, 4) if done else 0.0,
+            "elapsed_s": round(elapsed, 1),
+            **scan,
+        }
+
+    def run(self):
+        """刷新线程：按固定间隔更新进度条，并定期输出机器可读的进度行"""
+        next_log = time.monotonic() + self.log_interval
+        with tqdm(total=self.total, desc=self.desc, unit="文件") as pbar:
+            while True:
+                stopped = self.stopped.wait(self.interval)
+                stats = self.stats()
+                pbar.total = self.total
+                pbar.update(stats["files_done"] - pbar.n)
+                inflight = f"进行中 {stats['inflight']}  " if stats["inflight"] is not None else ""
+                if "scanned" in stats and not stats["scan_finished"]:
+                    inflight = f"扫描 {stats['scanned']} ({stats['scan_per_s']}/s)  " + inflight
+                pbar.set_postfix_str(
+                    f"{format_bytes(stats['bytes_per_s'])}/s  {inflight}"
+                    f"失败 {stats['failed']} ({stats['error_rate']:.1%})",
+                    refresh=False,
+                )
+                pbar.refresh()
+                if self.on_update:
+                    self.on_update(stats["files_done"], stats["files_total"] or 0)
+                if self.log_interval and (stopped or time.monotonic() >= next_log):
+                    next_log = time.monotonic() + self.log_interval
+                    self.logger.info("PROGRESS " + json.dumps(stats, ensure_ascii=False, separators=(",", ":")))
+                if stopped:
+                    return
@@ -0,0 +1,205 @@
+import bisect
+import heapq
+import itertools
+import random
+import threading
+import time
+
+# 失败的处理方式
+RETRY = "retry"  # 按退避时间重新排队
+GIVE_UP = "give_up"  # 不再重试（如文件不存在）
+ABORT = "abort"  # 停止全部下载（如认证失效）
+
+# 一刻相册接口返回的 error_code
+AUTH_ERROR_CODES = (-6, 110, 111)  # 身份验证失败、access token 无效或过期
+NOT_FOUND_ERROR_CODES = (-9, 31066)  # 文件不存在
+
+# 下载顺序：newest=新照片优先（默认），smallest=小文件优先，largest=大文件优先，interleave=按大小分档交错
+SCHEDULE_POLICIES = ("newest", "smallest", "largest", "interleave")
+SIZE_CLASSES = (1024 * 1024, 8 * 1024 * 1024, 64 * 1024 * 1024)  # interleave 的分档界线(字节)
+
+
+class AuthError(Exception):
+    """认证信息失效，继续请求没有意义"""
+
+
+class PermanentError(Exception):
+    """重试也不会成功的错误，如文件不存在、超过大小限制"""
+
+
+def retry_delay(attempts, base_delay, max_delay):
+    """第 attempts 次失败后的等待时间：指数退避，乘以 0.5~1.5 的随机抖动，避免大量任务同时重试"""
+    return min(base_delay * 2 ** (attempts - 1), max_delay) * random.uniform(0.5, 1.5)
+
+
+def spread(index, items):
+    """把一档文件均匀分布在 [0, 1) 上，第 k 个位于 (k + 0.5) / n"""
+    count = len(items)
+    for k, item in enumerate(items):
+        yield (k + 0.5) / count, index, item
+
+
+def interleave_by_size(rows):
+    """按大小分档后按比例穿插：任何一段下载中各档文件的比例都与整体相同，
+    始终有大文件占满带宽、也始终有小文件在完成。rows 为 (item, size)，同一档内保持原顺序"""
+    classes = [[] for _ in range(len(SIZE_CLASSES) + 1)]
+    for item, size in rows:
+        classes[bisect.bisect_right(SIZE_CLASSES, size or 0)].append(item)
+    streams = [spread(index, items) for index, items in enumerate(classes) if items]
+    for _, _, item in heapq.merge(*streams):
+        yield item
+
+
+def classify_error(error):
+    """根据异常类型和 HTTP 状态码决定重试、放弃还是停止全部下载"""
+    if isinstance(error, AuthError):
+        return ABORT
+    if isinstance(error, PermanentError):
+        return GIVE_UP
+    response = getattr(error, "response", None)
+    status = response.status_code if response is not None else getattr(error, "status", None)
+    if status == 401:
+        return ABORT
+    if status == 404:
+        return GIVE_UP
+    # 5xx、429、网络错误、校验失败等都可能是暂时的
+    return RETRY
+
+
+# 重试调度器：固定数量的下载线程从优先队列中取最早到期的任务，
+# 失败的任务按自己的指数退避（带随机抖动）重新排队，不需要等待整轮结束
+class RetryScheduler:
+    def __init__(self, handle, workers, logger, max_attempts=5, base_delay=2.0, max_delay=300.0):
+        self.handle = handle  # item -> None 表示成功，否则返回失败的异常
+        self.workers = workers
+        self.logger = logger
+        self.max_attempts = max_attempts  # 每个文件连续失败的最多次数（包括以前运行中的失败）
+        self.base_delay = base_delay  # 第一次重试前的等待(秒)，之后每次翻倍
+        self.max_delay = max_delay  # 重试等待的上限(秒)
+        self.max_queued = workers * 2  # 队列中最多有多少个尚未尝试的任务，防止一次读入全部待下载文件
+        self.on_finished = None  # 文件得到最终结果时的回调，参数为 (item, success)
+        # item -> (失败记录中的累计失败次数, 距可以重试还需等待的秒数)；
+        # 提供时按失败记录继续退避，重新运行不会从第一次重试重新开始
+        self.retry_state = None
+        self.condition = threading.Condition()
+        self.heap = []  # (可以开始的时间, 序号, 已失败次数, 是否占用名额, item)
+        self.sequence = itertools.count()  # 同一时间到期的任务按加入顺序处理
+        self.active = 0  # 正在处理的任务数
+        self.queued = 0  # 队列中尚未尝试的任务数，等待重试的不计入
+        self.producing = False  # 待下载文件是否还在陆续加入
+        self.abort_error = None
+        self.failed = []  # 重试次数用尽的文件
+        self.gave_up = []  # 不再重试的文件
+        self.retries = 0  # 重新排队的次数
+
+    def push(self, item, attempts=0, delay=0.0, counted=False):
+        """加入一个任务，delay 秒后可以开始（调用时需持有锁）；counted 表示占用尚未尝试的任务名额"""
+        heapq.heappush(self.heap, (time.monotonic() + delay, next(self.sequence), attempts, counted, item))
+        if counted:
+            self.queued += 1
+        self.condition.notify_all()
+
+    def produce(self, items):
+        """把待下载文件陆续加入队列，items 可以是边扫描边产出的迭代器"""
+        try:
+            for item in items:
+                with self.condition:
+                    # 等待重试的任务不占名额，下载线程不会因为退避而空闲
+                    while self.queued >= self.max_queued and not self.abort_error:
+                        self.condition.wait()
+                    if self.abort_error:
+                        return
+                    # 以前失败过的文件接着上次的退避等待，到时间后至少再尝试一次；等待中的不占名额
+                    attempts, delay = self.retry_state(item) if self.retry_state else (0, 0.0)
+                    self.push(item, attempts, delay, counted=delay <= 0)
+        finally:
+            with self.condition:
+                self.producing = False
+                self.condition.notify_all()
+
+    def next_task(self):
+        """取出最早到期的任务，没有到期的任务时等待；全部完成或中止时返回 None"""
+        with self.condition:
+            while True:
+                if self.abort_error:
+                    return None
+                if self.heap:
+                    ready_at = self.heap[0][0]
+                    now = time.monotonic()
+                    if ready_at <= now:
+                        _, _, attempts, counted, item = heapq.heappop(self.heap)
+                        if counted:
+                            self.queued -= 1
+                            self.condition.notify_all()
+                        self.active += 1
+                        return attempts, item
+                    self.condition.wait(ready_at - now)
+                elif not self.producing and self.active == 0:
+                    return None
+                else:
+                    self.condition.wait()
+
+    def complete(self, item, attempts, error):
+        """记录一次尝试的结果，失败时按错误类型决定是否重新排队"""
+        finished = True
+        with self.condition:
+            self.active -= 1
+            attempts += 1
+            if error is not None:
+                action = classify_error(error)
+                if action == ABORT:
+                    if not self.abort_error:
+                        self.abort_error = error
+                        self.logger.error(f"认证失败，停止全部下载: {error}")
+                elif action == GIVE_UP:
+                    self.gave_up.append(item)
+                    self.logger.warning(f"{item[1]} 无法下载，不再重试: {error}")
+                elif attempts < self.max_attempts:
+                    delay = self.backoff(item, attempts)
+                    self.push(item, attempts, delay)
+                    self.retries += 1
+                    finished = False
+                    self.logger.debug(f"{item[1]} 将在 {delay:.1f} 秒后第 {attempts + 1} 次尝试")
+                else:
+                    self.failed.append(item)
+            self.condition.notify_all()
+        if finished and self.on_finished:
+            self.on_finished(item, error is None)
+
+    def backoff(self, item, attempts):
+        """第 attempts 次失败后的等待时间；失败记录已按同样的退避算好时直接沿用，与下次运行读到的一致"""
+        if self.retry_state:
+            recorded, delay = self.retry_state(item)
+            if recorded == attempts:
+                return delay
+        return retry_delay(attempts, self.base_delay, self.max_delay)
+
+    def worker(self):
+        while True:
+            task = self.next_task()
+            if task is None:
+                return
+            attempts, item = task
+            try:
+                error = self.handle(item)
+            except Exception as e:
+                error = e
+            self.complete(item, attempts, error)
+
+    def run(self, items):
+        """下载全部任务，直到每个任务成功、放弃或重试次数用尽；认证失败时抛出异常"""
+        self.producing = True
+        producer = threading.Thread(target=self.produce, args=(items,), name="Producer", daemon=True)
+        producer.start()
+        threads = [
+            threading.Thread(target=self.worker, name=f"Downloader-{i}", daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if self.abort_error:
+            raise self.abort_error
+        producer.join()
+        return self.failed + self.gave_up
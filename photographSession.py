@@ -0,0 +1,135 @@
+import time
+from threading import Lock
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+
+# 元数据获取和照片下载共用的 HTTP 连接层：连接池、重试退避、超时和耗时统计
+class TransportStats:
+    def __init__(self):
+        self.lock = Lock()
+        self.connections = 0  # 新建连接数
+        self.connect_time = 0.0  # 建立连接(TCP+TLS)总耗时
+        self.requests = 0  # 请求数
+        self.response_time = 0.0  # 从发出请求到收到响应头的总耗时
+
+    def record_connect(self, seconds):
+        with self.lock:
+            self.connections += 1
+            self.connect_time += seconds
+
+    def record_response(self, response, *args, **kwargs):
+        """requests 的 response 钩子"""
+        with self.lock:
+            self.requests += 1
+            self.response_time += response.elapsed.total_seconds()
+
+    def summary(self):
+        with self.lock:
+            avg_connect = self.connect_time / self.connections * 1000 if self.connections else 0
+            avg_response = self.response_time / self.requests * 1000 if self.requests else 0
+            return (
+                f"HTTP 统计: 请求 {self.requests} 次，新建连接 {self.connections} 次；"
+                f"连接建立共 {self.connect_time:.1f} 秒(平均 {avg_connect:.0f} ms)，"
+                f"等待响应共 {self.response_time:.1f} 秒(平均 {avg_response:.0f} ms，含连接建立)"
+            )
+
+
+class RangeNotSupportedError(Exception):
+    """服务器忽略了 Range 请求头，返回了完整的文件"""
+
+
+# 下载块的读缓冲区池：每个正在读取的响应借用一块，读完归还，
+# 缓冲区数量等于同时读取的响应数，而不是线程数，也不必为每个下载块分配新的 bytes
+class BufferPool:
+    def __init__(self, size):
+        self.size = size
+        self.lock = Lock()
+        self.free = []
+        self.created = 0
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()  # 后进先出，优先复用刚用过（仍在缓存中）的缓冲区
+            self.created += 1
+        return bytearray(self.size)
+
+    def release(self, buffer):
+        with self.lock:
+            if len(buffer) == self.size:
+                self.free.append(buffer)
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """统计连接建立耗时，并为没有指定超时的请求加上默认超时"""
+
+    def __init__(self, stats, timeout=None, **kwargs):
+        self.stats = stats
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        class TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPSConnection(HTTPSConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                stats.record_connect(time.perf_counter() - start)
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+            ConnectionCls = TimedHTTPSConnection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": TimedHTTPConnectionPool,
+            "https": TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_session(config=None, stats=None):
+    """按 settings.json 中的 http_* 配置创建带连接池的会话"""
+    config = config or {}
+    pool_size = int(config.get("http_pool_size", 40))
+    retry_strategy = Retry(
+        total=int(config.get("http_retries", 3)),
+        backoff_factor=float(config.get("http_backoff_factor", 1)),
+        status_forcelist=[429, 500, 502, 503, 504]
+    )
+    timeout = (
+        float(config.get("http_connect_timeout", 10)),
+        float(config.get("http_read_timeout", 60)),
+    )
+
+    stats = stats or TransportStats()
+    adapter = TimedHTTPAdapter(
+        stats,
+        timeout=timeout,
+        max_retries=retry_strategy,
+        pool_connections=pool_size,  # 连接池数量
+        pool_maxsize=pool_size       # 每个连接池的最大连接数
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.hooks["response"].append(stats.record_response)
+    return session